@@ -0,0 +1,69 @@
+import struct
+from collections import namedtuple
+
+try:
+    import opuslib
+except ImportError:  # Opus frames are rejected when libopus/opuslib isn't installed
+    opuslib = None
+
+# Binary /ws/audio frames (protocol version 2):
+#   version:u8  codec:u8  flags:u8  reserved:u8  seq:u32  sample_rate:u32  payload...
+# All header fields are big-endian. Text frames keep the version 1 JSON/base64 format.
+PROTOCOL_VERSION = 2
+FRAME_HEADER = struct.Struct("!BBBxII")
+
+CODEC_PCM16 = 0
+CODEC_OPUS = 1
+
+FLAG_FINAL = 0x01
+
+OPUS_DECODE_RATE = 16000  # libopus resamples internally, so frames come out at the VAD rate
+OPUS_MAX_FRAME_SAMPLES = OPUS_DECODE_RATE * 120 // 1000  # longest Opus packet is 120 ms
+
+AudioFrame = namedtuple("AudioFrame", ["seq", "codec", "sample_rate", "final", "payload"])
+
+
+def parse_frame(data):
+    """Split a binary WebSocket message into its header fields and payload"""
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError("Audio frame shorter than header")
+    version, codec, flags, seq, sample_rate = FRAME_HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported audio protocol version: {version}")
+    if codec not in (CODEC_PCM16, CODEC_OPUS):
+        raise ValueError(f"Unsupported audio codec: {codec}")
+    payload = memoryview(data)[FRAME_HEADER.size:]
+    return AudioFrame(seq, codec, sample_rate, bool(flags & FLAG_FINAL), payload)
+
+
+class AudioFrameDecoder:
+    """
+    Per-connection decoder for binary audio frames.
+    Drops duplicate or out-of-order frames and turns every payload into
+    16-bit mono PCM bytes, decoding Opus on the server.
+    """
+    def __init__(self):
+        self.last_seq = None
+        self.dropped_frames = 0
+        self._opus = None
+
+    def _decode_opus(self, payload):
+        if opuslib is None:
+            raise ValueError("Opus audio is not supported by this server")
+        if self._opus is None:
+            self._opus = opuslib.Decoder(OPUS_DECODE_RATE, 1)
+        try:
+            return self._opus.decode(bytes(payload), OPUS_MAX_FRAME_SAMPLES)
+        except opuslib.OpusError as e:
+            raise ValueError(f"Invalid Opus frame: {e}")
+
+    def decode(self, frame):
+        """Returns (pcm, sample_rate) as a bytes-like object, or (None, None) for a stale frame"""
+        if self.last_seq is not None and frame.seq <= self.last_seq:
+            self.dropped_frames += 1
+            return None, None
+        self.last_seq = frame.seq
+
+        if frame.codec == CODEC_OPUS:
+            return self._decode_opus(frame.payload), OPUS_DECODE_RATE
+        return frame.payload, frame.sample_rate
@@ -0,0 +1,139 @@
+# audio_service.py
+# Real-time speech-to-text over /ws/audio. Everything that needs torch/Silero is
+# imported from here, so the main API can start without it (ENABLE_AUDIO_ROUTES=false)
+# and the audio stack can be deployed on its own: `uvicorn audio_service:app`.
+import asyncio
+import base64
+import json
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect
+from prometheus_fastapi_instrumentator import Instrumentator
+from audio_session import AudioSession
+from audio_protocol import AudioFrameDecoder, parse_frame, CODEC_PCM16
+from utils import init_openai_client, close_openai_client
+from llm_metrics import llm_endpoint
+
+audio_router = APIRouter()
+
+@audio_router.websocket("/ws/audio")
+async def websocket_audio_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    llm_endpoint.set("/ws/audio")  # this handler runs in its own task; transcription tasks inherit it
+
+    async def send_transcript(transcription, final):
+        # "final" keeps the original message so existing clients still render it
+        await websocket.send_json({
+            "message": "Transcriptions Generated" if final else "Partial Transcription",
+            "type": "final" if final else "partial",
+            "transcription": transcription
+        })
+
+    session = AudioSession(on_transcript=send_transcript)
+    frame_decoder = AudioFrameDecoder()
+    # PCM runs through the session's streaming resampler while Opus skips it,
+    # so switching codecs would reorder audio around the resampler's buffered tail
+    session_codec = None
+
+    # Capture rate is negotiated once: ?sample_rate=48000, else the first audio message
+    if websocket.query_params.get("sample_rate"):
+        try:
+            session.set_sample_rate(int(websocket.query_params["sample_rate"]))
+        except ValueError as e:
+            await websocket.close(code=1003, reason=str(e))
+            return
+    
+    async def ping_client():
+        while True:
+            try:
+                await asyncio.sleep(10)
+                await websocket.send_json({"message": "ping"})
+            except Exception as e:
+                print(f"Ping error: {e}")
+                break
+
+    ping_task = asyncio.create_task(ping_client())
+    
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=5.0)
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                pcm_data = None
+
+                if message.get("bytes") is not None:
+                    # Protocol v2: binary frame with header, PCM or Opus payload
+                    frame = parse_frame(message["bytes"])
+                    if session_codec is None:
+                        session_codec = frame.codec
+                    elif frame.codec != session_codec:
+                        raise ValueError(f"Codec changed mid-session: {frame.codec}")
+                    pcm_data, sample_rate = frame_decoder.decode(frame)
+                    # Opus always decodes at the VAD rate, whatever capture rate was negotiated
+                    if pcm_data is not None and frame.codec == CODEC_PCM16:
+                        if session.sample_rate is None:
+                            session.set_sample_rate(sample_rate)
+                        elif sample_rate != session.sample_rate:
+                            raise ValueError(f"Sample rate changed mid-session: {sample_rate}")
+                    is_final = frame.final
+                else:
+                    # Protocol v1: JSON with base64 PCM in stream_bytes
+                    sample_rate = None  # the negotiated session rate
+                    message = json.loads(message["text"])
+                    stream_bytes = message.get("stream_bytes")
+                    if stream_bytes:
+                        if session_codec is None:
+                            session_codec = CODEC_PCM16
+                        elif session_codec != CODEC_PCM16:
+                            raise ValueError("Codec changed mid-session: PCM after Opus")
+                        pcm_data = base64.b64decode(stream_bytes)
+                        if session.sample_rate is None:
+                            session.set_sample_rate(int(message.get("sample_rate", 16000)))
+                    is_final = message.get("is_final") or message.get("type") == "stop"
+
+                if pcm_data:
+                    events = await session.add_pcm(pcm_data, sample_rate)
+
+                    for event in events:
+                        if "start" in event:
+                            await websocket.send_json({"message": "speech_start", "timestamp": event["start"] / 16000})
+                        else:
+                            await websocket.send_json({"message": "speech_end", "timestamp": event["end"] / 16000})
+
+                if is_final:
+                    session.flush()
+                elif pcm_data:
+                    session.request_partial()
+    
+            except asyncio.TimeoutError:
+                continue   
+
+            except ValueError as e:
+                print(f"Invalid audio message: {e}")
+                await websocket.send_json({"message": "error", "detail": str(e)})
+            
+            except WebSocketDisconnect:
+                print("Client disconnected")
+                break
+            
+    except Exception as e:
+        print(f"Error in websocket loop: {e}")
+        try:
+            await websocket.close()
+        except:
+            pass
+    finally:
+        ping_task.cancel() 
+        session.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_openai_client()
+    yield
+    await close_openai_client()
+
+# Standalone audio app for a separately scaled deployment
+app = FastAPI(lifespan=lifespan)
+app.include_router(audio_router)
+Instrumentator().instrument(app).expose(app, endpoint="/metrics", include_in_schema=False)
@@ -0,0 +1,310 @@
+import asyncio
+import os
+import tempfile
+from collections import deque
+import numpy as np
+from prometheus_client import Gauge, Histogram
+from audio_utils import (
+    StreamingVAD,
+    StreamingResampler,
+    VAD_SAMPLE_RATE,
+    SUPPORTED_SAMPLE_RATES,
+    pcm_to_wav
+)
+from utils import speech_to_text_with_vad
+
+MIN_SPEECH_SAMPLES = VAD_SAMPLE_RATE * 250 // 1000  # same floor get_speech_timestamps used
+MAX_SEGMENT_SAMPLES = VAD_SAMPLE_RATE * 20  # cut long monologues so each upload stays small
+RING_BUFFER_SAMPLES = VAD_SAMPLE_RATE * 30  # must hold a full segment plus VAD padding
+PROMPT_CONTEXT_CHARS = 200
+
+# Endpointing: an utterance is final once this much silence follows it
+ENDPOINT_SILENCE_MS = int(os.getenv("ENDPOINT_SILENCE_MS", "700"))
+# Partial transcripts of the utterance in progress, at most this often (0 disables)
+PARTIAL_INTERVAL_MS = int(os.getenv("PARTIAL_INTERVAL_MS", "2000"))
+# Per-session RAM for segments waiting on STT; older ones beyond it spill to a memory-mapped file
+AUDIO_MEMORY_BUDGET_BYTES = int(os.getenv("AUDIO_MEMORY_BUDGET_BYTES", str(2 * 1024 * 1024)))
+
+AUDIO_MEMORY_BYTES = Gauge("audio_memory_bytes", "Audio held in RAM by all /ws/audio sessions")
+AUDIO_SPILLED_BYTES = Gauge("audio_spilled_bytes", "Audio spilled to memory-mapped files by all /ws/audio sessions")
+AUDIO_SESSION_PEAK_MEMORY = Histogram(
+    "audio_session_peak_memory_bytes", "Peak audio RAM of a /ws/audio session",
+    buckets=(256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6)
+)
+
+
+class PCMRingBuffer:
+    """
+    Preallocated ring of int16 samples addressed by absolute sample index.
+    Reads return views into the ring unless the range wraps around its end.
+    """
+    def __init__(self, capacity=RING_BUFFER_SAMPLES):
+        self.capacity = capacity
+        self._samples = np.zeros(capacity, dtype=np.int16)
+        self.end = 0  # absolute index one past the newest sample
+
+    @property
+    def start(self):
+        """Absolute index of the oldest sample still held"""
+        return max(0, self.end - self.capacity)
+
+    def write(self, samples):
+        if len(samples) > self.capacity:
+            self.end += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        pos = self.end % self.capacity
+        first = min(len(samples), self.capacity - pos)
+        self._samples[pos:pos + first] = samples[:first]
+        self._samples[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+
+    def read(self, start, end):
+        start = max(start, self.start)
+        end = min(end, self.end)
+        if end <= start:
+            return self._samples[:0]
+        pos = start % self.capacity
+        if pos + (end - start) <= self.capacity:
+            return self._samples[pos:pos + end - start]
+        return np.concatenate((self._samples[pos:], self._samples[:end - start - (self.capacity - pos)]))
+
+    def clear(self):
+        self.end = 0
+
+
+class SegmentStore:
+    """
+    FIFO of finalized int16 segments waiting for transcription.
+    Keeps the newest segments in RAM up to `budget_bytes`; older ones are
+    appended to a per-session temp file and read back through a memory map,
+    so a stalled STT backlog can't grow a worker's RSS without bound.
+    """
+    def __init__(self, budget_bytes=AUDIO_MEMORY_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self._segments = deque()  # np.ndarray (in RAM) or (offset, length) in the spill file
+        self._file = None
+        self._file_end = 0
+
+    def __len__(self):
+        return len(self._segments)
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="audio_session_")
+        for i, segment in enumerate(self._segments):
+            if self.memory_bytes <= self.budget_bytes:
+                break
+            if not isinstance(segment, np.ndarray):
+                continue
+            self._file.seek(self._file_end)
+            self._file.write(segment.tobytes())
+            self._segments[i] = (self._file_end, len(segment))
+            self._file_end += segment.nbytes
+            self.memory_bytes -= segment.nbytes
+            self.spilled_bytes += segment.nbytes
+            AUDIO_MEMORY_BYTES.dec(segment.nbytes)
+            AUDIO_SPILLED_BYTES.inc(segment.nbytes)
+        self._file.flush()
+
+    def append(self, segment):
+        self._segments.append(segment)
+        self.memory_bytes += segment.nbytes
+        AUDIO_MEMORY_BYTES.inc(segment.nbytes)
+        if self.memory_bytes > self.budget_bytes:
+            self._spill()
+
+    def popleft(self):
+        segment = self._segments.popleft()
+        if isinstance(segment, np.ndarray):
+            self.memory_bytes -= segment.nbytes
+            AUDIO_MEMORY_BYTES.dec(segment.nbytes)
+            return segment
+        offset, length = segment
+        # copy out of the map: the file is truncated once the spilled backlog drains
+        segment = np.array(np.memmap(self._file, dtype=np.int16, mode="r", offset=offset, shape=(length,)))
+        self.spilled_bytes -= segment.nbytes
+        AUDIO_SPILLED_BYTES.dec(segment.nbytes)
+        if not self.spilled_bytes:
+            self._file.truncate(0)
+            self._file_end = 0
+        return segment
+
+    def clear(self):
+        AUDIO_MEMORY_BYTES.dec(self.memory_bytes)
+        AUDIO_SPILLED_BYTES.dec(self.spilled_bytes)
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self._segments.clear()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AudioSession:
+    """
+    Per-connection state for /ws/audio.
+    Each chunk is run through a streaming VAD exactly once, and only newly
+    finalized speech segments are sent to Whisper; their text is committed
+    and stitched, so per-chunk cost stays flat however long the session runs.
+
+    An utterance stays open across short VAD pauses and is only finalized
+    once ENDPOINT_SILENCE_MS of silence follows it. While it is open, partial
+    transcriptions are produced at most every PARTIAL_INTERVAL_MS of audio.
+
+    Transcription runs in a background task so the receive loop never waits
+    on STT. Finalized segments are always transcribed in order; partials are
+    "latest wins" and dropped when newer audio supersedes them.
+    """
+    def __init__(self, on_transcript, endpoint_silence_ms=ENDPOINT_SILENCE_MS, partial_interval_ms=PARTIAL_INTERVAL_MS):
+        self.on_transcript = on_transcript  # async callback(stitched transcript, final)
+        self.sample_rate = None  # client capture rate, fixed once negotiated
+        self._resampler = None  # carries filter state across chunks when the rate isn't 16 kHz
+        self.endpoint_silence_samples = VAD_SAMPLE_RATE * endpoint_silence_ms // 1000
+        self.partial_interval_samples = VAD_SAMPLE_RATE * partial_interval_ms // 1000
+        self.vad = StreamingVAD()
+        self.ring = PCMRingBuffer()
+        AUDIO_MEMORY_BYTES.inc(self.ring.capacity * 2)
+        self.peak_memory_bytes = 0
+        self.finished_segments = SegmentStore()  # int16 speech segments waiting for transcription
+        self.transcript_segments = []  # committed transcription text, in order
+        self._speech_start = None  # start of the open utterance
+        self._speech_end = None  # end of its last VAD segment, None while speech continues
+        self._last_partial_at = 0
+        self._pending_partial = None
+        self._wake = asyncio.Event()
+        self._transcriber = None
+
+    @property
+    def memory_bytes(self):
+        """Audio this session currently holds in RAM"""
+        partial = self._pending_partial.nbytes if self._pending_partial is not None else 0
+        return self.ring.capacity * 2 + self.finished_segments.memory_bytes + partial
+
+    @property
+    def transcript(self):
+        return " ".join(self.transcript_segments)
+
+    def _schedule(self):
+        if self._transcriber is None:
+            self._transcriber = asyncio.create_task(self._transcription_loop())
+        self._wake.set()
+
+    def _finish_segment(self, end):
+        if end - self._speech_start >= MIN_SPEECH_SAMPLES:
+            # copy out of the ring: it will be overwritten before the upload finishes
+            self.finished_segments.append(self.ring.read(self._speech_start, end).copy())
+            self._pending_partial = None
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+            self._schedule()
+        self._speech_start = None
+        self._speech_end = None
+
+    def set_sample_rate(self, sample_rate):
+        """Negotiate the client's capture rate once; chunks are resampled to 16 kHz on arrival"""
+        if sample_rate not in SUPPORTED_SAMPLE_RATES:
+            raise ValueError(f"Unsupported PCM sample rate: {sample_rate}")
+        self.sample_rate = sample_rate
+        if sample_rate != VAD_SAMPLE_RATE:
+            self._resampler = StreamingResampler(sample_rate)
+
+    async def add_pcm(self, pcm_bytes, sample_rate=None):
+        """
+        Feed a raw 16-bit PCM chunk; returns the VAD speech start/end events it triggered.
+        `sample_rate` overrides the session rate for chunks already decoded at another rate (Opus).
+        """
+        if self.sample_rate is None:
+            self.set_sample_rate(VAD_SAMPLE_RATE)
+        sample_rate = sample_rate or self.sample_rate
+        if sample_rate == VAD_SAMPLE_RATE:
+            samples = np.frombuffer(pcm_bytes, dtype=np.int16, count=len(pcm_bytes) // 2)
+        else:
+            samples = self._resampler.process(pcm_bytes)
+        self.ring.write(samples)
+        if self.vad.current_sample < self.ring.start:
+            # a single oversized chunk overran the ring; skip what was lost
+            self.vad.current_sample = self.ring.start
+
+        events = await self.vad.process(self.ring.read(self.vad.current_sample, self.ring.end))
+        for event in events:
+            if "start" in event:
+                if self._speech_end is not None and event["start"] - self._speech_end >= self.endpoint_silence_samples:
+                    self._finish_segment(self._speech_end)
+                if self._speech_start is None:
+                    self._speech_start = event["start"]
+                    self._last_partial_at = event["start"]
+                self._speech_end = None
+            elif self._speech_start is not None:
+                self._speech_end = event["end"]
+
+        if self._speech_start is not None:
+            if self._speech_end is not None:
+                if self.vad.current_sample - self._speech_end >= self.endpoint_silence_samples:
+                    self._finish_segment(self._speech_end)
+                elif self._speech_end - self._speech_start >= MAX_SEGMENT_SAMPLES:
+                    self._finish_segment(self._speech_end)
+            elif self.vad.current_sample - self._speech_start >= MAX_SEGMENT_SAMPLES:
+                # cut long monologues mid-speech and carry on with a new utterance
+                cut = self.vad.current_sample
+                self._finish_segment(cut)
+                self._speech_start = cut
+                self._last_partial_at = cut
+
+        return events
+
+    def request_partial(self):
+        """Queue a partial transcription of the open utterance if the interval has elapsed"""
+        if self._speech_start is None or not self.partial_interval_samples:
+            return
+        end = self._speech_end if self._speech_end is not None else self.vad.current_sample
+        if end - self._speech_start < MIN_SPEECH_SAMPLES:
+            return
+        if end - self._last_partial_at < self.partial_interval_samples:
+            return
+        self._last_partial_at = end
+        self._pending_partial = self.ring.read(self._speech_start, end).copy()
+        self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+        self._schedule()
+
+    def flush(self):
+        """Finalize the open utterance (client stopped recording)"""
+        if self._speech_start is not None:
+            self._finish_segment(self._speech_end if self._speech_end is not None else self.ring.end)
+
+    async def _transcribe(self, segment):
+        wav_bytes = await pcm_to_wav(segment.tobytes(), sample_rate=VAD_SAMPLE_RATE)
+        prompt = self.transcript[-PROMPT_CONTEXT_CHARS:] or None
+        text = await speech_to_text_with_vad(wav_bytes, prompt=prompt)
+        return text.replace("\n", " ").strip()
+
+    async def _transcription_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self.finished_segments or self._pending_partial is not None:
+                try:
+                    if self.finished_segments:
+                        text = await self._transcribe(self.finished_segments.popleft())
+                        if text:
+                            self.transcript_segments.append(text)
+                            await self.on_transcript(self.transcript, True)
+                    else:
+                        partial, self._pending_partial = self._pending_partial, None
+                        text = await self._transcribe(partial)
+                        # newer audio arrived while we waited on STT: this partial is stale
+                        if text and self._pending_partial is None and not self.finished_segments:
+                            await self.on_transcript(" ".join(self.transcript_segments + [text]), False)
+                except Exception as e:
+                    print(f"Transcription error: {e}")
+
+    def clear(self):
+        if self._transcriber is not None:
+            self._transcriber.cancel()
+        AUDIO_SESSION_PEAK_MEMORY.observe(self.peak_memory_bytes)
+        AUDIO_MEMORY_BYTES.dec(self.ring.capacity * 2)
+        self.finished_segments.clear()
+        self.transcript_segments.clear()
+        self._pending_partial = None
+        self.ring.clear()
+        self.vad.reset_states()
@@ -0,0 +1,252 @@
+import io
+import math
+import wave
+import threading
+from io import BytesIO
+from functools import lru_cache
+from pydub import AudioSegment
+import torch
+import torchaudio
+import numpy as np
+from silero_vad import load_silero_vad, get_speech_timestamps
+from vad_worker import VADBatchWorker
+
+_vad_model = None
+_vad_model_lock = threading.Lock()
+
+def get_vad_model():
+    """Silero is loaded on first use, so workers that never open /ws/audio don't pay for it"""
+    global _vad_model
+    with _vad_model_lock:
+        if _vad_model is None:
+            _vad_model = load_silero_vad()
+    return _vad_model
+
+VAD_SAMPLE_RATE = 16000
+VAD_WINDOW_SAMPLES = 512  # Silero v5 expects 512-sample windows at 16 kHz
+VAD_CONTEXT_SAMPLES = 64
+SUPPORTED_SAMPLE_RATES = (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000)
+
+# all connections share one batched inference thread for the model
+vad_worker = VADBatchWorker(get_vad_model)
+
+async def pcm_to_wav(pcm_bytes, sample_rate=16000, channels=1, sample_width=2):
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(sample_width)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm_bytes)
+    return buffer.getvalue()
+
+async def combine_audio_streams(audio_streams):
+    """Combine multiple WAV audio streams into one WAV file"""
+    combined_audio = AudioSegment.empty()
+    for audio_stream in audio_streams:
+        audio_segment = AudioSegment.from_wav(io.BytesIO(audio_stream))
+        combined_audio += audio_segment
+    wav_buffer = io.BytesIO()
+    combined_audio.export(wav_buffer, format="wav")
+    wav_bytes = wav_buffer.getvalue()
+    return wav_bytes
+
+@lru_cache(maxsize=None)
+def get_resampler(orig_freq, new_freq=VAD_SAMPLE_RATE):
+    """Building a Resample kernel is costly, so one per rate pair is shared by every session"""
+    return torchaudio.transforms.Resample(orig_freq, new_freq)
+
+class StreamingResampler:
+    """
+    Per-session resampler to the VAD rate for chunked int16 PCM.
+    Resampling each chunk on its own adds edge artifacts at every boundary and,
+    when chunks aren't whole multiples of the rate ratio, drifts in length.
+    This buffers input to whole blocks of the ratio (441 in -> 160 out for
+    44.1 kHz), keeps a filter-width tail of input on both sides of what it
+    resamples, and only emits output that is complete, so the concatenated
+    output matches resampling the whole stream at once (lagging it by the
+    right-hand context, about 10 ms).
+    """
+    def __init__(self, orig_freq, new_freq=VAD_SAMPLE_RATE):
+        gcd = math.gcd(orig_freq, new_freq)
+        self.block_in = orig_freq // gcd
+        self.block_out = new_freq // gcd
+        self.resampler = get_resampler(orig_freq, new_freq)
+        # input samples the sinc kernel reaches on each side (torchaudio: lowpass_filter_width=6, rolloff=0.99)
+        width = math.ceil(6 * self.block_in / (min(self.block_in, self.block_out) * 0.99))
+        self.context = math.ceil((width + 1) / self.block_in) * self.block_in
+        # the stream starts after zeros, as whole-signal resampling pads it
+        self._buffer = np.zeros(self.context, dtype=np.float32)
+
+    @torch.no_grad()
+    def process(self, pcm):
+        """Feed int16 PCM (bytes or array); returns the int16 output that is now complete"""
+        if not isinstance(pcm, np.ndarray):
+            pcm = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2)
+        self._buffer = np.concatenate((self._buffer, pcm.astype(np.float32) * (1.0 / 32768.0)))
+        ready = (len(self._buffer) - 2 * self.context) // self.block_in * self.block_in
+        if ready <= 0:
+            return np.zeros(0, dtype=np.int16)
+        window = torch.from_numpy(self._buffer[:ready + 2 * self.context])
+        resampled = self.resampler(window)
+        skip = self.context // self.block_in * self.block_out
+        output = resampled[skip:skip + ready // self.block_in * self.block_out]
+        self._buffer = self._buffer[ready:]
+        return output.mul_(32768.0).clamp_(-32768, 32767).to(torch.int16).numpy()
+
+
+@torch.no_grad()
+def pcm16_to_tensor(pcm, sample_rate=VAD_SAMPLE_RATE):
+    """Convert int16 PCM (bytes or array) to a float tensor at the VAD sample rate in one pass"""
+    if not isinstance(pcm, np.ndarray):
+        pcm = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2)
+    audio_tensor = torch.from_numpy(pcm.astype(np.float32)).mul_(1.0 / 32768.0)
+    if sample_rate != VAD_SAMPLE_RATE:
+        audio_tensor = get_resampler(sample_rate)(audio_tensor)
+    return audio_tensor
+
+async def detect_speech_segments(audio_bytes, sample_rate=16000):
+    """
+    Use Silero VAD to detect speech segments in audio
+    Returns list of speech timestamps and filtered audio
+    """
+    try:
+        if isinstance(audio_bytes, bytes):
+            audio_tensor = pcm16_to_tensor(audio_bytes, sample_rate)
+        elif sample_rate != VAD_SAMPLE_RATE:
+            audio_tensor = get_resampler(sample_rate)(audio_bytes)
+        else:
+            audio_tensor = audio_bytes
+        
+        speech_timestamps = get_speech_timestamps(
+            audio_tensor, 
+            get_vad_model(),
+            sampling_rate=16000,
+            threshold=0.5,
+            min_speech_duration_ms=250, 
+            min_silence_duration_ms=100, 
+            return_seconds=False  
+        )
+        
+        if not speech_timestamps:
+            return None, None
+
+        speech_chunks = []
+        for segment in speech_timestamps:
+            start_sample = segment['start']
+            end_sample = segment['end']
+            speech_chunks.append(audio_tensor[start_sample:end_sample])
+
+        if speech_chunks:
+            filtered_audio = torch.cat(speech_chunks, dim=0)
+            return speech_timestamps, filtered_audio
+        else:
+            return None, None
+            
+    except Exception as e:
+        print(f"VAD error: {e}")
+
+class StreamingVAD:
+    """
+    VADIterator-style streaming wrapper around the shared Silero model.
+    Keeps its own recurrent state so each connection only feeds newly
+    arrived samples, and emits {'start': n} / {'end': n} events in samples.
+    """
+    def __init__(self, threshold=0.5, min_silence_duration_ms=100, speech_pad_ms=30):
+        self.threshold = threshold
+        self.min_silence_samples = VAD_SAMPLE_RATE * min_silence_duration_ms // 1000
+        self.speech_pad_samples = VAD_SAMPLE_RATE * speech_pad_ms // 1000
+        self.reset_states()
+
+    def reset_states(self):
+        self._state = torch.zeros(2, 1, 128)
+        self._context = torch.zeros(1, VAD_CONTEXT_SAMPLES)
+        self.triggered = False
+        self.temp_end = 0
+        self.current_sample = 0
+
+    def _step(self, speech_prob):
+        self.current_sample += VAD_WINDOW_SAMPLES
+
+        if speech_prob >= self.threshold and self.temp_end:
+            self.temp_end = 0
+
+        if speech_prob >= self.threshold and not self.triggered:
+            self.triggered = True
+            speech_start = max(0, self.current_sample - self.speech_pad_samples - VAD_WINDOW_SAMPLES)
+            return {"start": speech_start}
+
+        if speech_prob < self.threshold - 0.15 and self.triggered:
+            if not self.temp_end:
+                self.temp_end = self.current_sample
+            if self.current_sample - self.temp_end < self.min_silence_samples:
+                return None
+            speech_end = self.temp_end + self.speech_pad_samples - VAD_WINDOW_SAMPLES
+            self.temp_end = 0
+            self.triggered = False
+            return {"end": speech_end}
+
+        return None
+
+    async def process(self, samples):
+        """
+        Run VAD over 16 kHz int16 samples starting at `current_sample`.
+        Only whole windows are consumed; callers pass the remainder again next time.
+        """
+        usable = len(samples) - len(samples) % VAD_WINDOW_SAMPLES
+        windows = torch.from_numpy(samples[:usable].astype(np.float32)).div_(32768.0).view(-1, VAD_WINDOW_SAMPLES)
+        probs, self._state, self._context = await vad_worker.infer(windows, self._state, self._context)
+
+        events = []
+        for speech_prob in probs:
+            event = self._step(speech_prob)
+            if event:
+                events.append(event)
+        return events
+
+async def tensor_to_wav_bytes(audio_tensor, sample_rate=16000):
+    """Convert torch tensor to WAV bytes"""
+    if audio_tensor.dtype != torch.float32:
+        audio_tensor = audio_tensor.float()
+    
+    audio_tensor = audio_tensor * 32767
+    audio_tensor = torch.clamp(audio_tensor, -32768, 32767)
+    audio_np = audio_tensor.numpy().astype(np.int16)
+    
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)  # Mono
+        wf.setsampwidth(2)  # 16-bit
+        wf.setframerate(sample_rate)
+        wf.writeframes(audio_np.tobytes())
+    return buffer.getvalue()
+
+async def combine_audio_streams_with_vad(audio_streams):
+    """Combine multiple WAV audio streams with VAD filtering"""
+    if not audio_streams:
+        return None
+    
+    combined_speech_chunks = []
+    
+    for audio_stream in audio_streams:
+        try:
+            audio_segment = AudioSegment.from_wav(io.BytesIO(audio_stream))
+            
+            raw_audio = audio_segment.raw_data
+            sample_rate = audio_segment.frame_rate
+
+            speech_timestamps, filtered_audio = await detect_speech_segments(raw_audio, sample_rate)
+            
+            if filtered_audio is not None:
+                combined_speech_chunks.append(filtered_audio)
+                
+        except Exception as e:
+            print(f"Error processing audio stream: {e}")
+
+    if not combined_speech_chunks:
+        return None
+    
+    combined_audio_tensor = torch.cat(combined_speech_chunks, dim=0)
+    
+    audio_bytes = await tensor_to_wav_bytes(combined_audio_tensor)
+    
+    return audio_bytes
@@ -0,0 +1,295 @@
+# Replays recorded audio over concurrent /ws/audio connections, with STT served
+# by benchmarks/fake_openai.py, to see how the audio pipeline scales with
+# session length and concurrency.
+#
+#   cd backend && python benchmarks/audio_replay.py --sessions 20 --session-seconds 60 --speed 1
+#   cd backend && python benchmarks/audio_replay.py --fixture clinic_dictation_48k.wav --sessions 50 --speed 4
+#   cd backend && python benchmarks/audio_replay.py --legacy --legacy-lengths 10 30 60
+#
+# Fixtures are 16-bit WAV files (--fixture, repeatable). Without them, synthetic
+# fixtures are generated for every --kinds x --rates pair. The speech-like signal
+# is a voiced buzz in phrases and pauses, so use real recordings when VAD
+# decisions matter. Session i replays fixture i % len(fixtures), looped up to
+# --session-seconds, in --chunk-ms chunks at --speed times real time.
+#
+# The server (audio_service:app under probe_server.py) times every chunk's
+# resample + VAD step and samples event-loop lag. Its CPU time and peak RSS are
+# read from /proc (Linux). Prints one JSON line per session and a summary line.
+#
+# --legacy times combine_audio_streams_with_vad and detect_speech_segments
+# in-process instead. The old receive loop re-ran them over the whole session
+# on every message, so their cost per call grows with session length.
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+import httpx
+import websockets
+from fake_openai import add_config_arguments
+from load_test import (
+    BACKEND_DIR, free_port, latency_summary, percentile, read_probe,
+    start_fake_openai, start_probed_app, stop, wait_ready
+)
+
+sys.path.insert(0, BACKEND_DIR)
+from audio_protocol import FRAME_HEADER, PROTOCOL_VERSION, CODEC_PCM16, FLAG_FINAL  # noqa: E402
+
+SYNTHETIC_SECONDS = 20
+
+
+def speech_like(rate, seconds):
+    """Voiced buzz at ~4 syllables/s in 2.8 s phrases separated by 1.2 s pauses"""
+    t = np.arange(int(rate * seconds)) / rate
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    syllables = 0.5 * (1 - np.cos(2 * np.pi * 4 * t))
+    phrases = (t % 4.0) < 2.8
+    noise = np.random.default_rng(0).normal(0, 0.01, len(t))
+    signal = voiced * syllables * phrases / np.abs(voiced).max() * 0.3 + noise
+    return (signal * 32767).astype(np.int16)
+
+
+def synthetic_fixture(kind, rate, seconds=SYNTHETIC_SECONDS):
+    if kind == "speech":
+        return speech_like(rate, seconds)
+    if kind == "noise":
+        return (np.random.default_rng(1).normal(0, 0.03, int(rate * seconds)) * 32767).astype(np.int16)
+    if kind == "silence":
+        return np.zeros(int(rate * seconds), dtype=np.int16)
+    raise ValueError(f"Unknown fixture kind: {kind}")
+
+
+def load_fixture(path):
+    """(int16 mono samples, sample rate) from a 16-bit WAV file; extra channels are dropped"""
+    with wave.open(path) as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM WAV is supported")
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        return samples[::wav.getnchannels()].copy(), wav.getframerate()
+
+
+def fixtures_from_args(args):
+    """[(name, samples, sample rate), ...]"""
+    if args.fixture:
+        return [(os.path.basename(path), *load_fixture(path)) for path in args.fixture]
+    return [(f"{kind}@{rate}", synthetic_fixture(kind, rate), rate) for kind in args.kinds for rate in args.rates]
+
+
+def looped(samples, rate, seconds):
+    """The fixture repeated (and cut) to `seconds` of audio"""
+    total = int(rate * seconds)
+    return np.resize(samples, total) if total else samples
+
+
+def frame(seq, rate, payload, final=False):
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, CODEC_PCM16, FLAG_FINAL if final else 0, seq, rate) + payload
+
+
+class SessionStats:
+    def __init__(self, index, name, rate):
+        self.index = index
+        self.name = name
+        self.rate = rate
+        self.audio_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.sent = []  # (audio seconds sent so far, monotonic time), ascending
+        self.final_sent_at = None
+        self.speech_end_lags = []
+        self.final_lags = []
+        self.partials = 0
+        self.errors = 0
+        self._speech_end_at = None  # when the audio of the latest unclaimed speech_end was sent
+
+    def sent_time(self, audio_seconds):
+        """Monotonic time at which the audio up to `audio_seconds` had been sent"""
+        positions = [position for position, _ in self.sent]
+        i = min(bisect.bisect_left(positions, audio_seconds), len(self.sent) - 1)
+        return self.sent[i][1]
+
+    def on_message(self, message, received_at):
+        kind = message.get("message")
+        if kind == "speech_end":
+            self._speech_end_at = self.sent_time(message["timestamp"])
+            self.speech_end_lags.append(received_at - self._speech_end_at)
+        elif message.get("type") == "final":
+            # from the end of the speech it covers; a flushed utterance counts from the final frame
+            ended_at = self._speech_end_at if self._speech_end_at is not None else self.final_sent_at
+            if ended_at is not None:
+                self.final_lags.append(received_at - ended_at)
+            self._speech_end_at = None
+        elif message.get("type") == "partial":
+            self.partials += 1
+        elif kind == "error":
+            self.errors += 1
+
+    def row(self):
+        return {
+            "session": self.index,
+            "fixture": self.name,
+            "sample_rate": self.rate,
+            "audio_seconds": self.audio_seconds,
+            "wall_seconds": self.wall_seconds,
+            "speech_ends": len(self.speech_end_lags),
+            "finals": len(self.final_lags),
+            "partials": self.partials,
+            "errors": self.errors,
+            "final_lag_ms": latency_summary(self.final_lags),
+        }
+
+
+async def replay(url, stats, samples, args):
+    chunk = stats.rate * args.chunk_ms // 1000
+    chunk_seconds = chunk / stats.rate
+    async with websockets.connect(f"{url}/ws/audio?sample_rate={stats.rate}", max_size=None) as ws:
+        async def receive():
+            async for raw in ws:
+                stats.on_message(json.loads(raw), time.monotonic())
+
+        receiver = asyncio.ensure_future(receive())
+        started = time.monotonic()
+        for seq, offset in enumerate(range(0, len(samples), chunk)):
+            # pace against the schedule so a slow send doesn't shift every later chunk
+            await asyncio.sleep(max(0, started + seq * chunk_seconds / args.speed - time.monotonic()))
+            await ws.send(frame(seq, stats.rate, samples[offset:offset + chunk].tobytes()))
+            stats.sent.append((min(len(samples), offset + chunk) / stats.rate, time.monotonic()))
+        await ws.send(frame(seq + 1, stats.rate, b"", final=True))
+        stats.final_sent_at = time.monotonic()
+        await asyncio.sleep(args.drain_seconds)  # trailing transcripts
+        stats.wall_seconds = time.monotonic() - started
+        stats.audio_seconds = len(samples) / stats.rate
+        receiver.cancel()
+
+
+def process_usage(pid):
+    """(CPU seconds, peak RSS in MB) of a process from /proc, or (None, None) off Linux"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        return cpu_seconds, peak_kb / 1024
+    except (OSError, StopIteration):
+        return None, None
+
+
+async def run(args):
+    fixtures = fixtures_from_args(args)
+    openai_port, app_port = free_port(), free_port()
+    probe_file = tempfile.NamedTemporaryFile(prefix="audio_replay_probe_", suffix=".json", delete=False).name
+    processes = [start_fake_openai(openai_port, args)]
+    try:
+        await wait_ready(f"http://127.0.0.1:{openai_port}/_stats", processes[0])
+        server = start_probed_app(
+            "audio_service:app", app_port, openai_port, probe_file, extra_args=["--time-audio-chunks"]
+        )
+        processes.append(server)
+        url = f"ws://127.0.0.1:{app_port}"
+        await wait_ready(f"http://127.0.0.1:{app_port}/metrics", server)
+
+        # one short session first, so Silero loading and resampler setup are not measured
+        name, samples, rate = fixtures[0]
+        await replay(url, SessionStats(-1, name, rate), looped(samples, rate, 2), argparse.Namespace(
+            chunk_ms=args.chunk_ms, speed=10, drain_seconds=0.5
+        ))
+
+        cpu_before, _ = process_usage(server.pid)
+        started_wall = time.time()
+        sessions = []
+        for index in range(args.sessions):
+            name, samples, rate = fixtures[index % len(fixtures)]
+            sessions.append((SessionStats(index, name, rate), looped(samples, rate, args.session_seconds or 0)))
+        await asyncio.gather(*(replay(url, stats, samples, args) for stats, samples in sessions))
+        finished_wall = time.time()
+        cpu_after, peak_rss_mb = process_usage(server.pid)
+
+        async with httpx.AsyncClient() as client:
+            openai_requests = (await client.get(f"http://127.0.0.1:{openai_port}/_stats")).json()
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+    probe = read_probe(probe_file)
+    chunks = [(seconds, audio) for at, seconds, audio in probe["audio_chunks"] if started_wall <= at <= finished_wall]
+    lag = [seconds for at, seconds in probe["lag"] if started_wall <= at <= finished_wall]
+    audio_seconds = sum(stats.audio_seconds for stats, _ in sessions)
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None else None
+
+    for stats, _ in sessions:
+        print(json.dumps(stats.row()))
+    chunk_rtf = [seconds / audio for seconds, audio in chunks if audio]
+    print(json.dumps({"summary": {
+        "sessions": args.sessions,
+        "fixtures": sorted({stats.name for stats, _ in sessions}),
+        "chunk_ms": args.chunk_ms,
+        "speed": args.speed,
+        "audio_seconds": audio_seconds,
+        "chunk_processing_ms": latency_summary([seconds for seconds, _ in chunks]),
+        # processing time per second of audio, per chunk; above 1 the server can't keep up
+        "chunk_rtf": {k: percentile(chunk_rtf, q) for k, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+        if chunk_rtf else None,
+        # server CPU per second of audio across all sessions (one core = 1.0)
+        "cpu_rtf": cpu_seconds / audio_seconds if cpu_seconds is not None and audio_seconds else None,
+        "cpu_seconds_per_session": cpu_seconds / args.sessions if cpu_seconds is not None else None,
+        "peak_rss_mb": peak_rss_mb,
+        "event_loop_lag_ms": latency_summary(lag),
+        "speech_end_lag_ms": latency_summary([lag for stats, _ in sessions for lag in stats.speech_end_lags]),
+        "final_transcript_lag_ms": latency_summary([lag for stats, _ in sessions for lag in stats.final_lags]),
+        "partial_transcripts": sum(stats.partials for stats, _ in sessions),
+        "errors": sum(stats.errors for stats, _ in sessions),
+        "openai_requests": openai_requests,
+    }}))
+
+
+async def run_legacy(args):
+    """Time the whole-buffer VAD helpers on growing sessions, as the old receive loop called them"""
+    from audio_utils import combine_audio_streams_with_vad, detect_speech_segments, pcm_to_wav
+
+    for name, samples, rate in fixtures_from_args(args):
+        for seconds in args.legacy_lengths:
+            audio = looped(samples, rate, seconds)
+            chunk = rate * args.chunk_ms // 1000
+            wav_chunks = [await pcm_to_wav(audio[i:i + chunk].tobytes(), sample_rate=rate) for i in range(0, len(audio), chunk)]
+            for function, call in (
+                ("detect_speech_segments", lambda: detect_speech_segments(audio.tobytes(), rate)),
+                ("combine_audio_streams_with_vad", lambda: combine_audio_streams_with_vad(wav_chunks)),
+            ):
+                started = time.perf_counter()
+                await call()
+                elapsed = time.perf_counter() - started
+                print(json.dumps({
+                    "legacy": function,
+                    "fixture": name,
+                    "sample_rate": rate,
+                    "audio_seconds": seconds,
+                    "seconds": elapsed,
+                    "rtf": elapsed / seconds,
+                }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay audio fixtures over concurrent /ws/audio sessions")
+    parser.add_argument("--fixture", action="append", help="16-bit WAV file (repeatable)")
+    parser.add_argument("--kinds", nargs="+", default=["speech", "noise", "silence"], help="synthetic fixture kinds")
+    parser.add_argument("--rates", nargs="+", type=int, default=[8000, 16000, 48000], help="synthetic sample rates")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent connections")
+    parser.add_argument("--session-seconds", type=float, default=60, help="audio per session (0: fixture length)")
+    parser.add_argument("--chunk-ms", type=int, default=100)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay pace; 1 is real time")
+    parser.add_argument("--drain-seconds", type=float, default=3.0, help="wait for transcripts after the last chunk")
+    parser.add_argument("--legacy", action="store_true", help="time the whole-buffer VAD helpers instead")
+    parser.add_argument("--legacy-lengths", nargs="+", type=float, default=[10, 30, 60])
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(run_legacy(args) if args.legacy else run(args))
+
+
+if __name__ == "__main__":
+    main()
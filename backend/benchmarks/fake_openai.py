@@ -0,0 +1,327 @@
+# Local stand-in for the OpenAI API, so the app can be load-tested without spending tokens.
+#
+#   cd backend && python benchmarks/fake_openai.py --port 9100 --ttft 0.4 --tokens-per-second 60
+#   OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=fake uvicorn main:app
+#
+# Serves chat completions (streaming and not, including the structured hook
+# response), Whisper transcriptions, and the files/batches calls used by the
+# offline content calendar. Timing and error injection come from the command
+# line and can be changed at runtime with POST /_config; GET /_stats counts requests.
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+import uuid
+import wave
+from collections import Counter
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+import uvicorn
+
+DEFAULT_CONFIG = {
+    "latency": 0.05,  # seconds before any response (connection + queueing upstream)
+    "ttft": 0.4,  # further seconds until the first token
+    "tokens_per_second": 60.0,  # output rate once streaming
+    "completion_tokens": 400,  # length of a free-text answer when max_tokens is not set
+    "error_rate": 0.0,  # share of requests answered with an error instead
+    "error_statuses": [429, 500],  # picked at random for injected errors
+    "retry_after": 1,  # Retry-After seconds sent with injected 429s
+    "stt_rtf": 0.1,  # transcription time per second of audio
+    "batch_delay": 5.0,  # seconds until a batch reports completed
+    "seed": None,
+}
+config = dict(DEFAULT_CONFIG)
+stats = Counter()
+
+WORDS = (
+    "patients clinicians burnout retention care teams trust outcomes nurses evidence "
+    "prevention wellbeing access quality digital health workforce leadership recovery "
+    "research empathy safety innovation community primary hospital data"
+).split()
+
+# OpenAI caches prompt prefixes in 128-token steps once a prompt is at least 1024 tokens
+_seen_prefixes = set()
+_files = {}  # file id -> (filename, bytes)
+_batches = {}  # batch id -> batch dict (plus private "_ready_at")
+
+app = FastAPI()
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _words(count):
+    return [random.choice(WORDS) for _ in range(count)]
+
+
+def _fake_text(count):
+    words = _words(max(1, count - 3))
+    return " ".join(words).capitalize() + ".\n\n#HealthcareLeadership #Retention #Wellbeing"
+
+
+def _fake_hooks():
+    return json.dumps({"hooks": [" ".join(_words(6)).capitalize() + "?" for _ in range(5)]})
+
+
+def _answer(body):
+    """The full assistant text for a chat request"""
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema" and response_format["json_schema"].get("name") == "hooks":
+        return _fake_hooks()
+    if response_format.get("type") in ("json_object", "json_schema"):
+        return json.dumps({"topics": [" ".join(_words(4)) for _ in range(5)]})
+    return _fake_text(body.get("max_tokens") or config["completion_tokens"])
+
+
+def _usage(body, completion_tokens):
+    messages = body.get("messages", [])
+    prompt_tokens = sum(_tokens(str(m.get("content", ""))) for m in messages)
+    prefix = str(messages[0].get("content", "")) if messages else ""
+    cached = 0
+    if prompt_tokens >= 1024:
+        if prefix in _seen_prefixes:
+            cached = min(prompt_tokens, _tokens(prefix)) // 128 * 128
+        _seen_prefixes.add(prefix)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+def _injected_error():
+    if random.random() >= config["error_rate"]:
+        return None
+    status = random.choice(config["error_statuses"])
+    stats[f"error_{status}"] += 1
+    headers = {"Retry-After": str(config["retry_after"])} if status == 429 else None
+    kind = "rate_limit_exceeded" if status == 429 else "server_error"
+    return JSONResponse(
+        {"error": {"message": f"Injected {status}", "type": kind, "code": kind, "param": None}},
+        status_code=status, headers=headers
+    )
+
+
+def _chunks(text):
+    """Split an answer into token-sized pieces (~4 characters)"""
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["chat_stream" if body.get("stream") else "chat"] += 1
+    await asyncio.sleep(config["latency"])
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    answer = _answer(body)
+    pieces = _chunks(answer)
+    usage = _usage(body, len(pieces))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    model = body.get("model", "gpt-4o")
+
+    if not body.get("stream"):
+        await asyncio.sleep(config["ttft"] + len(pieces) / config["tokens_per_second"])
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": usage,
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+    def chunk(delta, finish_reason=None, chunk_usage=None, choices=True):
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}] if choices else [],
+            "usage": chunk_usage,
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def events():
+        yield chunk({"role": "assistant", "content": ""})
+        await asyncio.sleep(config["ttft"])
+        interval = 1 / config["tokens_per_second"]
+        next_at = time.monotonic()
+        for piece in pieces:
+            yield chunk({"content": piece})
+            # pace against a schedule so slow sleeps don't accumulate drift
+            next_at += interval
+            await asyncio.sleep(max(0, next_at - time.monotonic()))
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk(None, chunk_usage=usage, choices=False)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _wav_seconds(data):
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        return len(data) / 32000  # assume 16 kHz, 16-bit mono
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(
+    file: UploadFile = File(...),
+    model: str = Form("whisper-1"),
+    response_format: str = Form("json"),
+    language: str = Form(None),
+    prompt: str = Form(None),
+):
+    stats["transcription"] += 1
+    audio_seconds = _wav_seconds(await file.read())
+    await asyncio.sleep(config["latency"] + audio_seconds * config["stt_rtf"])
+    error = _injected_error()
+    if error is not None:
+        return error
+    text = " ".join(_words(max(1, int(audio_seconds * 2.5))))  # ~150 spoken words per minute
+    if response_format == "text":
+        return PlainTextResponse(text + "\n")
+    return {"text": text}
+
+
+@app.post("/v1/files")
+async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    stats["file_upload"] += 1
+    data = await file.read()
+    file_id = f"file-{uuid.uuid4().hex[:24]}"
+    _files[file_id] = (file.filename, data)
+    return _file_object(file_id, purpose)
+
+
+def _file_object(file_id, purpose):
+    filename, data = _files[file_id]
+    return {
+        "id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+        "filename": filename, "purpose": purpose, "status": "processed",
+    }
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in _files:
+        return JSONResponse({"error": {"message": "No such file", "type": "invalid_request_error"}}, status_code=404)
+    return Response(_files[file_id][1], media_type="application/octet-stream")
+
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    stats["batch"] += 1
+    if body.get("input_file_id") not in _files:
+        return JSONResponse({"error": {"message": "No such file", "type": "invalid_request_error"}}, status_code=404)
+
+    # answer every line now; the batch only reports completed after batch_delay
+    output = []
+    for line in _files[body["input_file_id"]][1].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request_line = json.loads(line)
+        answer = _answer(request_line["body"])
+        output.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+            "custom_id": request_line["custom_id"],
+            "response": {"status_code": 200, "body": {
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": _usage(request_line["body"], len(_chunks(answer))),
+            }},
+            "error": None,
+        }))
+    output_file_id = f"file-{uuid.uuid4().hex[:24]}"
+    _files[output_file_id] = ("batch_output.jsonl", ("\n".join(output) + "\n").encode("utf-8"))
+
+    batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+    _batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": body.get("endpoint", "/v1/chat/completions"),
+        "input_file_id": body["input_file_id"],
+        "completion_window": body.get("completion_window", "24h"),
+        "created_at": int(time.time()),
+        "_output_file_id": output_file_id,
+        "_ready_at": time.monotonic() + config["batch_delay"],
+    }
+    return _batch_object(batch_id)
+
+
+def _batch_object(batch_id):
+    batch = _batches[batch_id]
+    ready = time.monotonic() >= batch["_ready_at"]
+    public = {k: v for k, v in batch.items() if not k.startswith("_")}
+    public["status"] = "completed" if ready else "in_progress"
+    public["output_file_id"] = batch["_output_file_id"] if ready else None
+    return public
+
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str):
+    if batch_id not in _batches:
+        return JSONResponse({"error": {"message": "No such batch", "type": "invalid_request_error"}}, status_code=404)
+    return _batch_object(batch_id)
+
+
+@app.post("/_config")
+async def update_config(request: Request):
+    """Change timing or error injection mid-run, e.g. {"ttft": 2.0, "error_rate": 0.1}"""
+    changes = await request.json()
+    unknown = set(changes) - set(DEFAULT_CONFIG)
+    if unknown:
+        return JSONResponse({"error": f"Unknown settings: {sorted(unknown)}"}, status_code=400)
+    config.update(changes)
+    return config
+
+
+@app.get("/_stats")
+async def get_stats():
+    return dict(stats)
+
+
+def add_config_arguments(parser):
+    """Command-line flags for every DEFAULT_CONFIG setting (shared with load_test.py)"""
+    for name, default in DEFAULT_CONFIG.items():
+        flag = "--" + name.replace("_", "-")
+        if isinstance(default, list):
+            parser.add_argument(flag, dest=name, type=int, nargs="+", default=default)
+        elif default is None:
+            parser.add_argument(flag, dest=name, type=int, default=None)
+        else:
+            parser.add_argument(flag, dest=name, type=type(default), default=default)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI API for local load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    config.update({name: getattr(args, name) for name in DEFAULT_CONFIG})
+    if config["seed"] is not None:
+        random.seed(config["seed"])
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
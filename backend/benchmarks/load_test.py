@@ -0,0 +1,314 @@
+# End-to-end load test of the /healthcare flow without spending tokens.
+#
+#   cd backend && python benchmarks/load_test.py --users 20 --duration 60 --ttft 0.4 --error-rate 0.02
+#
+# Starts benchmarks/fake_openai.py and the real app (main:app, text routes only,
+# under probe_server.py) on free ports, then runs --users virtual users through
+# signup -> available_templates -> select_template -> generate_hooks -> select_hook
+# -> generate_linkedin_post/stream -> posts/save until --duration is up.
+# Prints one JSON line per endpoint (requests, errors, throughput, p50/p95/p99)
+# and a summary line with flow throughput, the app's event-loop lag and the
+# OpenAI calls the fake server received. The app writes users and posts to
+# --mongo, so point it at a throwaway local MongoDB.
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+import httpx
+from fake_openai import DEFAULT_CONFIG, add_config_arguments
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(BACKEND_DIR, "benchmarks")
+
+TOPICS = [
+    "nurse burnout after night shifts",
+    "keeping young doctors in rural clinics",
+    "patient trust in telemedicine",
+    "what hospital leaders get wrong about retention",
+    "mental health days for care teams",
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def latency_summary(seconds, scale=1000):
+    """count/p50/p95/p99/max of a list of seconds, in milliseconds by default"""
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "p50": percentile(seconds, 0.50) * scale,
+        "p95": percentile(seconds, 0.95) * scale,
+        "p99": percentile(seconds, 0.99) * scale,
+        "max": max(seconds) * scale,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # endpoint -> seconds of successful requests
+        self.errors = defaultdict(int)
+        self.flows_completed = 0
+        self.flows_failed = 0
+        self.flow_seconds = []
+
+    async def timed(self, name, send):
+        """Await `send` (an httpx request), record its latency under `name`, return the response"""
+        started = time.monotonic()
+        try:
+            response = await send
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            raise
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            response.raise_for_status()
+        self.latencies[name].append(time.monotonic() - started)
+        return response
+
+
+async def stream_post(client, results, headers):
+    """POST the post stream, recording time to first byte and to the end of the stream"""
+    name = "/healthcare/generate_linkedin_post/stream"
+    started = time.monotonic()
+    first_byte = None
+    content = []
+    try:
+        async with client.stream("POST", name, headers=headers) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            async for text in response.aiter_text():
+                if first_byte is None:
+                    first_byte = time.monotonic() - started
+                content.append(text)
+    except httpx.HTTPError:
+        results.errors[name] += 1
+        raise
+    results.latencies[name].append(time.monotonic() - started)
+    if first_byte is not None:
+        results.latencies[name + " (first byte)"].append(first_byte)
+    return "".join(content)
+
+
+async def stream_hooks(client, results, headers, body):
+    """POST the hook stream, recording time to the first hook and to the last"""
+    name = "/healthcare/generate_hooks/stream"
+    started = time.monotonic()
+    hooks = []
+    try:
+        async with client.stream("POST", name, headers=headers, json=body) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    if not hooks:
+                        results.latencies[name + " (first hook)"].append(time.monotonic() - started)
+                    hooks.append(json.loads(line))
+    except httpx.HTTPError:
+        results.errors[name] += 1
+        raise
+    results.latencies[name].append(time.monotonic() - started)
+    return hooks
+
+
+async def virtual_user(client, results, index, run_id, deadline, args):
+    email = f"loadtest-{run_id}-{index}@example.com"
+    response = await results.timed("/signup", client.post("/signup", json={
+        "name": f"Load Test {index}", "email": email, "password": "loadtest", "mobile": "0000000000"
+    }))
+    headers = {"Authorization": f"Bearer {response.json()['bearer_token']}"}
+
+    while time.monotonic() < deadline:
+        flow_started = time.monotonic()
+        try:
+            await results.timed(
+                "/healthcare/available_templates", client.get("/healthcare/available_templates", headers=headers)
+            )
+            await results.timed("/healthcare/select_template", client.post(
+                "/healthcare/select_template", params={"template_number": random.randint(1, 5)}, headers=headers
+            ))
+            # a unique input per flow, so hooks come from the model rather than the hook cache
+            body = {"user_input": f"{random.choice(TOPICS)} ({uuid.uuid4().hex[:8]})", "speculate": args.speculate}
+            if args.stream_hooks:
+                await stream_hooks(client, results, headers, body)
+            else:
+                await results.timed(
+                    "/healthcare/generate_hooks", client.post("/healthcare/generate_hooks", json=body, headers=headers)
+                )
+            await results.timed("/healthcare/select_hook", client.post(
+                "/healthcare/select_hook", params={"hook_number": 1}, headers=headers
+            ))
+            content = await stream_post(client, results, headers)
+            await results.timed("/healthcare/posts/save", client.post(
+                "/healthcare/posts/save", json={"content": content, "tags": ["loadtest"]}, headers=headers
+            ))
+            results.flows_completed += 1
+            results.flow_seconds.append(time.monotonic() - flow_started)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            results.flows_failed += 1
+            if args.verbose:
+                print(f"user {index}: flow failed: {e}", file=sys.stderr)
+            await asyncio.sleep(1)  # don't spin when every flow fails fast
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+
+
+def start_fake_openai(port, args):
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, "fake_openai.py"), "--port", str(port)]
+    for name in DEFAULT_CONFIG:
+        value = getattr(args, name)
+        if value is None:
+            continue
+        command.append("--" + name.replace("_", "-"))
+        if isinstance(value, list):
+            command.extend(str(v) for v in value)
+        else:
+            command.append(str(value))
+    return subprocess.Popen(command, cwd=BACKEND_DIR)
+
+
+def start_probed_app(app, port, openai_port, probe_file, env_overrides=(), extra_args=()):
+    """Run `app` (module:attribute) via probe_server.py against the fake OpenAI server"""
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+        **dict(env_overrides)
+    )
+    command = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, "probe_server.py"), app,
+        "--port", str(port), "--output", probe_file, *extra_args
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def read_probe(probe_file):
+    with open(probe_file) as f:
+        probe = json.load(f)
+    os.unlink(probe_file)
+    return probe
+
+
+def stop(process):
+    process.send_signal(signal.SIGINT)  # graceful, so the app's lifespan shutdown writes the probe file
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run(args):
+    processes = []
+    probe_file = None
+    try:
+        if args.app_url:
+            app_url = args.app_url
+        else:
+            openai_port, app_port = free_port(), free_port()
+            processes.append(start_fake_openai(openai_port, args))
+            await wait_ready(f"http://127.0.0.1:{openai_port}/_stats", processes[-1])
+            probe_file = tempfile.NamedTemporaryFile(prefix="load_test_probe_", suffix=".json", delete=False).name
+            processes.append(start_probed_app(
+                "main:app", app_port, openai_port, probe_file,
+                {"MONGO_CONNECTION_STRING": args.mongo, "ENABLE_AUDIO_ROUTES": "false"}
+            ))
+            app_url = f"http://127.0.0.1:{app_port}"
+            await wait_ready(f"{app_url}/metrics", processes[-1])
+
+        results = Results()
+        run_id = uuid.uuid4().hex[:8]
+        limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+        async with httpx.AsyncClient(base_url=app_url, timeout=httpx.Timeout(120.0), limits=limits) as client:
+            started_wall, started = time.time(), time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                virtual_user(client, results, index, run_id, deadline, args) for index in range(args.users)
+            ), return_exceptions=True)
+            elapsed = time.monotonic() - started
+            finished_wall = time.time()
+
+        openai_requests = None
+        if not args.app_url:
+            async with httpx.AsyncClient() as client:
+                openai_requests = (await client.get(f"http://127.0.0.1:{openai_port}/_stats")).json()
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+    lag = None
+    if probe_file:
+        samples = read_probe(probe_file)["lag"]
+        lag = latency_summary([seconds for at, seconds in samples if started_wall <= at <= finished_wall])
+
+    for name in sorted(set(results.latencies) | set(results.errors)):
+        print(json.dumps({
+            "endpoint": name,
+            "requests": len(results.latencies[name]) + results.errors[name],
+            "errors": results.errors[name],
+            "rps": len(results.latencies[name]) / elapsed,
+            **{f"{k}_ms": v for k, v in latency_summary(results.latencies[name]).items() if k != "count"},
+        }))
+    print(json.dumps({"summary": {
+        "users": args.users,
+        "duration_seconds": elapsed,
+        "flows_completed": results.flows_completed,
+        "flows_failed": results.flows_failed,
+        "flows_per_second": results.flows_completed / elapsed,
+        "flow_ms": latency_summary(results.flow_seconds),
+        "event_loop_lag_ms": lag,
+        "openai_requests": openai_requests,
+        "fake_openai": None if args.app_url else {name: getattr(args, name) for name in DEFAULT_CONFIG},
+    }}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /healthcare flow against a fake OpenAI server")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to keep starting new flows")
+    parser.add_argument("--think-time", type=float, default=0, help="mean pause between a user's flows")
+    parser.add_argument("--stream-hooks", action="store_true", help="use /generate_hooks/stream")
+    parser.add_argument("--no-speculate", dest="speculate", action="store_false", help="disable speculative posts")
+    parser.add_argument("--mongo", default="mongodb://127.0.0.1:27017", help="MongoDB the app writes to")
+    parser.add_argument("--app-url", help="load an already running app instead (no lag or OpenAI stats)")
+    parser.add_argument("--verbose", action="store_true")
+    add_config_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Runs one of the backend's ASGI apps under uvicorn with measurement probes,
+# for the load-test scripts in this directory.
+#
+#   cd backend && python benchmarks/probe_server.py main:app --port 8000 --output /tmp/probe.json
+#
+# Always samples event-loop lag (how late a 50 ms sleep wakes up); with
+# --time-audio-chunks it also times every AudioSession.add_pcm call.
+# Samples are written as JSON to --output when the server shuts down (SIGINT):
+#   {"lag": [[wall time, seconds], ...], "audio_chunks": [[wall time, seconds, chunk audio seconds], ...]}
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+LAG_INTERVAL_SECONDS = 0.05
+
+
+def time_audio_chunks(samples):
+    """Wrap AudioSession.add_pcm (resample + VAD for one chunk) to record its duration"""
+    from audio_session import AudioSession
+    add_pcm = AudioSession.add_pcm
+
+    async def timed_add_pcm(self, pcm_bytes, sample_rate=None):
+        started = time.perf_counter()
+        events = await add_pcm(self, pcm_bytes, sample_rate)
+        samples.append((time.time(), time.perf_counter() - started, len(pcm_bytes) / 2 / (sample_rate or self.sample_rate)))
+        return events
+
+    AudioSession.add_pcm = timed_add_pcm
+
+
+async def sample_lag(samples):
+    while True:
+        expected = time.monotonic() + LAG_INTERVAL_SECONDS
+        await asyncio.sleep(LAG_INTERVAL_SECONDS)
+        samples.append((time.time(), max(0.0, time.monotonic() - expected)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an app with event-loop lag and audio chunk probes")
+    parser.add_argument("app", help="module:attribute, e.g. main:app or audio_service:app")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--output", required=True, help="JSON file written at shutdown")
+    parser.add_argument("--time-audio-chunks", action="store_true")
+    args = parser.parse_args()
+
+    probe = {"lag": [], "audio_chunks": []}
+    if args.time_audio_chunks:
+        time_audio_chunks(probe["audio_chunks"])
+    module_name, attribute = args.app.split(":")
+    app = getattr(importlib.import_module(module_name), attribute)
+    app_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan_with_probe(app):
+        async with app_lifespan(app):
+            sampler = asyncio.create_task(sample_lag(probe["lag"]))
+            yield
+            sampler.cancel()
+            with open(args.output, "w") as f:
+                json.dump(probe, f)
+
+    app.router.lifespan_context = lifespan_with_probe
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
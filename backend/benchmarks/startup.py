@@ -0,0 +1,59 @@
+# Cold-start cost of the API entry points: import time and RSS right after import.
+#
+#   cd backend && python benchmarks/startup.py --repeat 5
+#
+# Each import runs in a fresh interpreter; one JSON line is printed per entry point.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("main (audio routes)", "main", {"ENABLE_AUDIO_ROUTES": "true"}),
+    ("main (text only)", "main", {"ENABLE_AUDIO_ROUTES": "false"}),
+    ("audio_service", "audio_service", {}),
+]
+
+PROBE = """
+import json, resource, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "torch_loaded": "torch" in sys.modules,
+}}))
+"""
+
+
+def measure(module, env_overrides):
+    env = dict(os.environ, **env_overrides)
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, module, env_overrides in CASES:
+        runs = [measure(module, env_overrides) for _ in range(args.repeat)]
+        print(json.dumps({
+            "entry_point": name,
+            "import_seconds_median": statistics.median(run["import_seconds"] for run in runs),
+            "max_rss_mb_median": statistics.median(run["max_rss_mb"] for run in runs),
+            "torch_loaded": runs[0]["torch_loaded"],
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+from healthcare import build_post_system_prompt
+from llm_governor import BACKGROUND
+from utils import generate_openai_response, get_openai_client, POST_MODEL
+
+# Calendar size: posts per week from the profile's posting_frequency, over CALENDAR_WEEKS
+CALENDAR_WEEKS = int(os.getenv("CALENDAR_WEEKS", "2"))
+CALENDAR_MAX_POSTS = int(os.getenv("CALENDAR_MAX_POSTS", "20"))
+POSTS_PER_WEEK = {"once_week": 1, "2-3_times_week": 3, "several_times_week": 5}
+
+
+def calendar_size(profile):
+    return min(CALENDAR_MAX_POSTS, POSTS_PER_WEEK.get(profile.get("posting_frequency"), 1) * CALENDAR_WEEKS)
+
+
+TOPICS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "topics",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"topics": {"type": "array", "items": {"type": "string"}}},
+            "required": ["topics"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+async def derive_topics(profile, count, user_email=None):
+    """Ask the model for `count` post topics that fit the user's profile"""
+    system_prompt = "You are an AI assistant planning LinkedIn content calendars for healthcare professionals."
+    user_prompt = f"""
+    Suggest {count} distinct LinkedIn post topics for this professional.
+    Specialty: {profile.get("industry_specialty", "healthcare")}
+    Target audience: {profile.get("target_audience", "healthcare professionals")}
+    Preferred content: {", ".join(profile.get("content_preferences", []))}
+    Topics to include: {profile.get("topics_to_include", "")}
+    Topics to avoid: {profile.get("topics_to_avoid", "")}
+    Return them as the "topics" array.
+    """
+    response = await generate_openai_response(
+        system_prompt, user_prompt, user=user_email, priority=BACKGROUND, template="calendar.topics",
+        response_format=TOPICS_RESPONSE_FORMAT
+    )
+    if response is None:  # refusal
+        return []
+    topics = json.loads(response)["topics"]
+    return [str(topic) for topic in topics][:count]
+
+
+async def _first_hook(healthcare, topic, user_email):
+    hooks = await healthcare.generate_hooks(topic, user_email, remember=False, priority=BACKGROUND)
+    if not hooks:
+        raise ValueError("No hooks generated")
+    return hooks[0]
+
+
+async def generate_calendar_posts(healthcare, user, topics, template):
+    """
+    Generate a hook and a post per topic concurrently (the governor bounds
+    the actual OpenAI concurrency). Yields {"topic", "hook", "content"} or
+    {"topic", "error"} as each post completes; pending work is cancelled
+    if the consumer stops early.
+    """
+    async def one(topic):
+        try:
+            hook = await _first_hook(healthcare, topic, user["email"])
+            system_prompt = build_post_system_prompt(template, hook, user)
+            content = await generate_openai_response(
+                system_prompt, topic, user=user["email"], priority=BACKGROUND, model=POST_MODEL,
+                template=template.prompt.key
+            )
+            return {"topic": topic, "hook": hook, "content": content}
+        except Exception as e:
+            print(f"Calendar post failed for '{topic}': {e}")
+            return {"topic": topic, "error": str(getattr(e, "detail", e))}
+
+    tasks = [asyncio.ensure_future(one(topic)) for topic in topics]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# Offline mode: posts go through the OpenAI Batch API (JSONL in, JSONL out).
+# The client honours OPENAI_BASE_URL, so a local stand-in can serve /files and /batches.
+
+async def hooks_for_topics(healthcare, user, topics):
+    """(topic, hook) pairs, generated concurrently; topics without hooks are dropped"""
+    async def one(topic):
+        try:
+            return topic, await _first_hook(healthcare, topic, user["email"])
+        except Exception as e:
+            print(f"Calendar hooks failed for '{topic}': {e}")
+            return topic, None
+
+    pairs = await asyncio.gather(*(one(topic) for topic in topics))
+    return [(topic, hook) for topic, hook in pairs if hook]
+
+
+def build_batch_file(items, template, user):
+    """
+    Batch API input: one chat-completion request per item, keyed by custom_id.
+    `items` are dicts with custom_id, topic and hook.
+    """
+    lines = []
+    for item in items:
+        lines.append(json.dumps({
+            "custom_id": item["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": POST_MODEL,
+                "messages": [
+                    {"role": "system", "content": build_post_system_prompt(template, item["hook"], user)},
+                    {"role": "user", "content": item["topic"]}
+                ]
+            }
+        }))
+    return "\n".join(lines) + "\n"
+
+
+def parse_batch_output(text):
+    """custom_id -> post content for each successful line of a Batch API output file"""
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+async def submit_batch(jsonl):
+    client = get_openai_client()
+    input_file = await client.files.create(file=("content_calendar.jsonl", jsonl.encode("utf-8")), purpose="batch")
+    return await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+
+
+async def fetch_batch_results(batch_id):
+    """(status, results) where results is None until the batch has completed"""
+    client = get_openai_client()
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        return batch.status, None
+    output = await client.files.content(batch.output_file_id)
+    return batch.status, parse_batch_output(output.text)
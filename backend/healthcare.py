@@ -4,7 +4,14 @@ import json
 import secrets
 from fastapi import HTTPException, Depends
 from pydantic import BaseModel
-from utils import generate_openai_response, generate_openai_response_stream, client_openai  # Add client_openai import here
+from utils import generate_openai_response, generate_openai_response_stream, get_openai_client, open_completion_stream
+from hook_cache import HookCache, make_key, HOOK_CACHE_MONGO
+from single_flight import SingleFlight, StreamFlight
+from llm_governor import governor, estimate_tokens, LLMUnavailable, INTERACTIVE, BACKGROUND
+from prompt_templates import compile_post_prompt, HOOK_PROMPT, HOOK_RESPONSE_FORMAT
+from hook_stream import HookArrayParser
+from llm_metrics import observe_completion
+from hedging import hedged_call
 from db import get_user_by_email, insert_user, update_user
 import random
 import smtplib
@@ -22,6 +29,18 @@ client = MongoClient(MONGO_CONNECTION_STRING)
 db = client["AI-Linkedin"]
 users_collection = db["users"]
 
+# Hook generation model; the hook prompt and its version live in prompt_templates.HOOK_PROMPT
+HOOK_MODEL = "gpt-4o"
+HOOK_COUNT = 5
+HOOK_REQUEST_OPTIONS = {"temperature": 0.7, "max_tokens": 300, "response_format": HOOK_RESPONSE_FORMAT}
+
+
+def _hooks_busy(error):
+    """Overloaded or rate limited upstream: tell the client to retry instead of returning no hooks"""
+    print(f"Hook generation rejected: {str(error)}")
+    headers = {"Retry-After": str(int(error.retry_after))} if error.retry_after else None
+    return HTTPException(status_code=503, detail="Hook generation is busy. Please retry shortly.", headers=headers)
+
 # Email credentials
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
@@ -50,6 +69,22 @@ class Template:
         self.description = description
         self.style = style
         self.post_length = post_length
+        self.prompt = compile_post_prompt(self)
+
+def build_post_system_prompt(selected_template, hook, current_user):
+    """System prompt for the final post; shared by live, speculative and content-calendar generation"""
+    # Define post length based on user profile or default to "medium"
+    post_length = "500"  # Default value
+    if "profile" in current_user and "preferred_post_length" in current_user["profile"]:
+        if current_user["profile"]["preferred_post_length"] == "short":
+            post_length = "300"
+        elif current_user["profile"]["preferred_post_length"] == "medium":
+            post_length = "500"
+        elif current_user["profile"]["preferred_post_length"] == "long":
+            post_length = "800"
+    
+    # the template's prompt was compiled at startup; only the per-request tail is formatted here
+    return selected_template.prompt.render(hook=hook, post_length=post_length)
 
 # Healthcare class to handle templates
 class Healthcare:
@@ -64,6 +99,10 @@ class Healthcare:
         self.selected_template = None
         # Add a dictionary to store user hooks
         self.user_hooks = {}  # {email: {"hooks": [...], "user_input": "...", "selected_hook_number": n}}
+        self.hook_cache = HookCache(collection=db["hook_cache"] if HOOK_CACHE_MONGO else None)
+        # concurrent identical hook requests share one OpenAI call
+        self.hook_flight = SingleFlight("hooks")
+        self.hook_stream_flight = StreamFlight("hooks_stream")
 
     def select_template(self, template_number: int):
         selected_template = list(self.templates.values())[template_number - 1]
@@ -87,46 +126,126 @@ class Healthcare:
         except json.JSONDecodeError:
             return {"error": "Failed to parse response into valid JSON format", "raw_response": post}
 
-    async def generate_hooks(self, user_input, user_email=None):
-        """Generate hooks and optionally store them for a specific user"""
-        system_prompt = "You are an AI assistant for generating catchy hooks for healthcare-specific LinkedIn posts."
-        user_prompt = f"""
-        Based solely on the following user input: '{user_input}',
-        generate 5 catchy hooks that are engaging, relevant, and tailored for healthcare professionals.
-        Output only the hooks in a valid JSON array format: ({{"hooks":["hook1", "hook2", "hook3", "hook4", "hook5"]}}).
-        Do not include any explanation, leading/trailing quotes, or extra text—just the JSON array.
+    async def generate_hooks(self, user_input, user_email=None, use_cache=True, remember=True, priority=INTERACTIVE):
         """
-        
-        # Generate hooks using OpenAI
+        Generate hooks and optionally store them for a specific user.
+        Batch callers pass remember=False so the user's interactive hook selection is left alone.
+        """
+        cache_key = make_key(user_input, HOOK_MODEL, HOOK_PROMPT.version)
+        if use_cache:
+            hooks = self.hook_cache.get(cache_key)
+            if hooks:
+                if user_email and remember:
+                    self.user_hooks[user_email] = {
+                        "hooks": hooks,
+                        "user_input": user_input
+                    }
+                return hooks
+
         hooks = []
         try:
-            response = await client_openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=300
+            hooks = await self.hook_flight.do(
+                cache_key, lambda: self._request_hooks(user_input, cache_key, user_email, priority)
             )
-            # Parse hooks from response
-            text = response.choices[0].message.content.strip().split("(")[-1].split(")")[0]
-
-            hooks = json.loads(text).get("hooks", [])
-            hooks = hooks[:5]  # Ensure we don't return more than 5 hooks
             
             # Store hooks if user_email is provided
-            if user_email:
+            if user_email and remember:
                 self.user_hooks[user_email] = {
                     "hooks": hooks,
                     "user_input": user_input
                 }
                 
+        except LLMUnavailable as e:
+            raise _hooks_busy(e)
         except Exception as e:
             # Handle any errors
             print(f"Error generating hooks: {str(e)}")
             
         return hooks
+
+    async def stream_hooks(self, user_input, user_email=None, use_cache=True):
+        """
+        Like generate_hooks, but yields each hook as soon as its JSON string is
+        complete. Identical concurrent requests share one upstream stream.
+        """
+        cache_key = make_key(user_input, HOOK_MODEL, HOOK_PROMPT.version)
+        hooks = self.hook_cache.get(cache_key) if use_cache else None
+        if hooks:
+            for hook in hooks:
+                yield hook
+        else:
+            hooks = []
+            parser = HookArrayParser()
+            try:
+                async def open_stream():
+                    model, pieces = await open_completion_stream(
+                        HOOK_MODEL, HOOK_PROMPT.messages(user_input=user_input),
+                        user=user_email, template=HOOK_PROMPT.key, **HOOK_REQUEST_OPTIONS
+                    )
+                    return self._cache_streamed_hooks(model, pieces, cache_key)
+
+                fanout = await self.hook_stream_flight.open(cache_key, open_stream)
+                pieces = fanout.subscribe()
+                try:
+                    async for piece in pieces:
+                        for hook in parser.feed(piece)[:HOOK_COUNT - len(hooks)]:
+                            hooks.append(hook)
+                            yield hook
+                finally:
+                    await pieces.aclose()  # a client that stops early leaves the shared stream
+            except LLMUnavailable as e:
+                raise _hooks_busy(e)
+            except Exception as e:
+                print(f"Error streaming hooks: {str(e)}")
+
+        if user_email and hooks:
+            self.user_hooks[user_email] = {
+                "hooks": hooks,
+                "user_input": user_input
+            }
+
+    async def _cache_streamed_hooks(self, model, pieces, cache_key):
+        """Pass a hook stream through once; when its array is complete, cache the hooks if HOOK_MODEL wrote them"""
+        parser = HookArrayParser()
+        hooks = []
+        try:
+            async for piece in pieces:
+                hooks.extend(parser.feed(piece))
+                yield piece
+        finally:
+            await pieces.aclose()
+        if parser.finished and model == HOOK_MODEL:
+            self.hook_cache.set(cache_key, hooks[:HOOK_COUNT])
+
+    async def _request_hooks(self, user_input, cache_key, user_email=None, priority=INTERACTIVE):
+        """Call OpenAI for hooks and cache the parsed result"""
+        messages = HOOK_PROMPT.messages(user_input=user_input)
+        def request(model, sent):
+            def create():
+                sent()  # the hedge deadline runs from here, after the governor's grant
+                return observe_completion(model, HOOK_PROMPT.key, get_openai_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **HOOK_REQUEST_OPTIONS
+                ))
+            return governor.call(
+                model,
+                create,
+                estimated_tokens=estimate_tokens(messages, max_tokens=HOOK_REQUEST_OPTIONS["max_tokens"]),
+                priority=priority,
+                user=user_email
+            )
+
+        # a slow HOOK_MODEL answer starts the backup model (interactive requests only); the first response wins
+        model, response = await hedged_call(HOOK_MODEL, request, hedge=priority != BACKGROUND)
+        message = response.choices[0].message
+        if getattr(message, "refusal", None):
+            raise ValueError(f"Model refused to generate hooks: {message.refusal}")
+        # the response format guarantees {"hooks": [...]}
+        hooks = json.loads(message.content)["hooks"][:HOOK_COUNT]
+        if model == HOOK_MODEL:  # the cache key names HOOK_MODEL; backup answers are served but not cached
+            self.hook_cache.set(cache_key, hooks)
+        return hooks
     
     def select_hook(self, user_email, hook_number):
         """Select a hook for a specific user"""
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from prometheus_client import Counter, Histogram
+
+# Hedged requests: if the primary model has not answered (or streamed its first
+# token) by its deadline, a backup model is started and the first to respond wins.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+DEFAULT_BACKUP_MODELS = {"gpt-4o": "gpt-4o-mini", "gpt-4o-2024-05-13": "gpt-4o-mini"}
+HEDGE_BACKUP_MODELS = {**DEFAULT_BACKUP_MODELS, **json.loads(os.getenv("HEDGE_BACKUP_MODELS", "{}"))}
+# Deadline = this percentile of recent first-token latencies, clamped to [min, max];
+# the default applies until enough samples have been seen.
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DEADLINE_SECONDS = float(os.getenv("HEDGE_DEFAULT_DEADLINE_SECONDS", "4"))
+HEDGE_MIN_DEADLINE_SECONDS = float(os.getenv("HEDGE_MIN_DEADLINE_SECONDS", "0.5"))
+HEDGE_MAX_DEADLINE_SECONDS = float(os.getenv("HEDGE_MAX_DEADLINE_SECONDS", "10"))
+
+LLM_FIRST_RESPONSE = Histogram(
+    "llm_first_response_seconds", "Time until an OpenAI call returns or streams its first token",
+    ["model", "mode"], buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20)
+)
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Backup requests started by the hedging policy", ["model", "winner"])
+
+
+class FirstResponseTracker:
+    """Rolling window of first-response latencies per (model, mode) that sets the hedge deadline"""
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+
+    def observe(self, model, mode, seconds):
+        self._samples.setdefault((model, mode), deque(maxlen=self.window)).append(seconds)
+        LLM_FIRST_RESPONSE.labels(model, mode).observe(seconds)
+
+    def deadline(self, model, mode):
+        samples = self._samples.get((model, mode))
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DEADLINE_SECONDS
+        ordered = sorted(samples)
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+        return min(HEDGE_MAX_DEADLINE_SECONDS, max(HEDGE_MIN_DEADLINE_SECONDS, value))
+
+
+first_response_tracker = FirstResponseTracker()
+
+
+def backup_model(model):
+    return HEDGE_BACKUP_MODELS.get(model) if HEDGE_ENABLED else None
+
+
+async def _race(model, start, mode, hedge=True):
+    """
+    Run start(model, sent); past the deadline also run start(backup, sent).
+    The request calls sent() whenever it actually goes out (after the governor's
+    grant, again on each retry): the deadline and the latency sample run from
+    there, so time queued behind the governor never triggers a hedge.
+    Returns (model, task) for the first task to succeed and cancels the other.
+    """
+    sent_at = {}
+    sent_event = asyncio.Event()
+
+    def sender(candidate):
+        def sent():
+            sent_at[candidate] = time.monotonic()
+            sent_event.set()
+        return sent
+
+    primary = asyncio.ensure_future(start(model, sender(model)))
+    backup = backup_model(model) if hedge else None
+    deadline = first_response_tracker.deadline(model, mode) if backup else None
+    try:
+        if deadline is None:
+            await asyncio.wait([primary])
+        while not primary.done():
+            if model not in sent_at:
+                sent = asyncio.ensure_future(sent_event.wait())
+                try:
+                    await asyncio.wait([primary, sent], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sent.cancel()
+                continue
+            remaining = deadline - (time.monotonic() - sent_at[model])
+            if remaining <= 0:
+                break
+            await asyncio.wait([primary], timeout=remaining)
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    if primary.done():
+        if primary.cancelled() or primary.exception() is not None:
+            return model, primary  # a failed primary is not hedged; the caller sees its error
+        if model in sent_at:
+            first_response_tracker.observe(model, mode, time.monotonic() - sent_at[model])
+        return model, primary
+
+    backup_task = asyncio.ensure_future(start(backup, sender(backup)))
+    racers = {primary: model, backup_task: backup}
+    winner = None
+    try:
+        pending = set(racers)
+        while winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if succeeded:
+                winner = succeeded[0]
+            elif not pending:
+                winner = primary  # both failed: surface the primary's error
+    finally:
+        losers = [task for task in racers if task is not winner]
+        for task in losers:
+            task.cancel()
+        # let the losers unwind (closing their connections) before anyone touches them again
+        await asyncio.gather(*losers, return_exceptions=True)
+
+    now = time.monotonic()
+    # when the backup wins, the primary took at least this long; recording it lets the deadline adapt upwards
+    first_response_tracker.observe(model, mode, now - sent_at[model])
+    if winner is backup_task and backup in sent_at:
+        first_response_tracker.observe(backup, mode, now - sent_at[backup])
+    LLM_HEDGES.labels(model, "backup" if winner is backup_task else "primary").inc()
+    return racers[winner], winner
+
+
+async def hedged_call(model, request, hedge=True):
+    """
+    Hedge a unary call. `request(model, sent)` returns an awaitable for one
+    request and calls sent() as it is sent. hedge=False (background work)
+    only runs the primary. Returns (model that answered, result).
+    """
+    winner_model, task = await _race(model, request, "call", hedge)
+    return winner_model, task.result()
+
+
+async def hedged_first_piece(model, open_pieces, hedge=True):
+    """
+    Hedge a stream on its first token. `open_pieces(model, sent)` returns an
+    async iterator of text pieces and calls sent() as the request is sent.
+    Returns (model, iterator, first piece or None); the losing stream is
+    cancelled, which closes its upstream connection.
+    """
+    sources = {}
+
+    async def first_piece(candidate, sent):
+        source = sources[candidate] = open_pieces(candidate, sent)
+        try:
+            return await source.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    winner_model, task = await _race(model, first_piece, "stream", hedge)
+    for candidate, source in sources.items():
+        if candidate != winner_model:
+            await source.aclose()
+    return winner_model, sources[winner_model], task.result()
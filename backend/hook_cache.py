@@ -0,0 +1,104 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from prometheus_client import Counter
+
+HOOK_CACHE_MAX_ENTRIES = int(os.getenv("HOOK_CACHE_MAX_ENTRIES", "1024"))
+HOOK_CACHE_TTL_SECONDS = int(os.getenv("HOOK_CACHE_TTL_SECONDS", "3600"))
+HOOK_CACHE_MONGO = os.getenv("HOOK_CACHE_MONGO", "false").lower() == "true"
+
+HOOK_CACHE_REQUESTS = Counter(
+    "hook_cache_requests_total", "Hook cache lookups", ["tier", "result"]
+)
+
+
+def normalize_input(user_input):
+    """Fold case, width and whitespace so trivially different submissions share an entry"""
+    text = unicodedata.normalize("NFKC", user_input).casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_key(user_input, model, prompt_version):
+    raw = f"{model}\x00{prompt_version}\x00{normalize_input(user_input)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class HookCache:
+    """
+    Two-tier cache for generated hooks.
+    An in-process LRU with TTL answers repeat submissions in microseconds;
+    an optional Mongo collection with a TTL index shares entries between workers.
+    """
+    def __init__(self, max_entries=HOOK_CACHE_MAX_ENTRIES, ttl_seconds=HOOK_CACHE_TTL_SECONDS, collection=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self._entries = OrderedDict()  # key -> (expires_at, hooks)
+        self._lock = threading.Lock()
+        if self.collection is not None:
+            # Mongo drops documents once expires_at has passed
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, hooks = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return hooks
+
+    def _set_local(self, key, hooks):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, hooks)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        hooks = self._get_local(key)
+        if hooks is not None:
+            HOOK_CACHE_REQUESTS.labels("memory", "hit").inc()
+            return hooks
+        HOOK_CACHE_REQUESTS.labels("memory", "miss").inc()
+
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        except Exception as e:
+            print(f"Hook cache lookup failed: {e}")
+            return None
+        if not doc:
+            HOOK_CACHE_REQUESTS.labels("mongo", "miss").inc()
+            return None
+        HOOK_CACHE_REQUESTS.labels("mongo", "hit").inc()
+        self._set_local(key, doc["hooks"])
+        return doc["hooks"]
+
+    def set(self, key, hooks):
+        if not hooks:
+            return
+        self._set_local(key, hooks)
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(
+                {"_id": key},
+                {"$set": {"hooks": hooks, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Hook cache write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,40 @@
+import json
+
+
+class HookArrayParser:
+    """
+    Incremental parser for the structured hook response {"hooks": ["...", ...]}.
+    feed() takes streamed text deltas and returns the hooks whose JSON string
+    closed in that delta, so each hook can be sent before the response ends.
+    """
+    def __init__(self):
+        self.in_array = False
+        self.finished = False
+        self._in_string = False
+        self._escaped = False
+        self._chars = []
+
+    def feed(self, text):
+        hooks = []
+        for char in text:
+            if self.finished:
+                break
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    raw, self._chars = "".join(self._chars), []
+                    if self.in_array:
+                        hooks.append(json.loads(f'"{raw}"', strict=False))  # decodes escapes such as \" and \u00e4
+                    continue
+                self._chars.append(char)
+            elif char == '"':
+                self._in_string = True  # strings before the array are the "hooks" key
+            elif char == "[":
+                self.in_array = True
+            elif char == "]" and self.in_array:
+                self.finished = True
+        return hooks
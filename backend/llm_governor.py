@@ -0,0 +1,289 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+import openai
+from prometheus_client import Counter, Gauge, Histogram
+
+INTERACTIVE = 0  # a user is watching: hooks, post streaming, live STT
+BACKGROUND = 1  # speculative and batch work, served only when interactive traffic leaves room
+
+# Per-model budgets: requests/min, tokens/min and concurrent calls.
+# Override with LLM_BUDGETS='{"gpt-4o": {"rpm": 500, "tpm": 30000, "concurrency": 32}}'
+DEFAULT_BUDGETS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000, "concurrency": 32},
+    "gpt-4o-2024-05-13": {"rpm": 500, "tpm": 30000, "concurrency": 32},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000, "concurrency": 64},
+    "whisper-1": {"rpm": 500, "tpm": 0, "concurrency": 32},  # tpm 0 = no token budget
+}
+FALLBACK_BUDGET = {"rpm": 500, "tpm": 30000, "concurrency": 32}
+LLM_BUDGETS = {**DEFAULT_BUDGETS, **json.loads(os.getenv("LLM_BUDGETS", "{}"))}
+# Budgets are the account's OpenAI limits, and each process enforces them on its own,
+# so every process sharing the API key gets an equal slice. Defaults to uvicorn's
+# WEB_CONCURRENCY; set LLM_PROCESS_COUNT to the total across services (main + audio).
+LLM_PROCESS_COUNT = max(1, int(os.getenv("LLM_PROCESS_COUNT", os.getenv("WEB_CONCURRENCY", "1"))))
+
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+LLM_MAX_WAIT_SECONDS = float(os.getenv("LLM_MAX_WAIT_SECONDS", "30"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_governor_queue_wait_seconds", "Time an OpenAI call waited for budget", ["model", "priority"]
+)
+LLM_QUEUE_DEPTH = Gauge("llm_governor_queue_depth", "OpenAI calls waiting for budget", ["model"])
+LLM_IN_FLIGHT = Gauge("llm_governor_in_flight", "OpenAI calls currently running", ["model"])
+LLM_REJECTIONS = Counter("llm_governor_rejections_total", "OpenAI calls refused by the governor", ["model", "reason"])
+LLM_RETRIES = Counter("llm_governor_retries_total", "OpenAI calls retried after a transient error", ["model", "reason"])
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class LLMUnavailable(Exception):
+    """Raised when a call is rejected or keeps failing; endpoints map it to a 503"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(messages, max_tokens=1000):
+    """Rough budget: ~4 characters per prompt token plus the completion allowance"""
+    return sum(len(message.get("content") or "") for message in messages) // 4 + max_tokens
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class _TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` is available (0 when it already is)"""
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def process_share(budget, processes=LLM_PROCESS_COUNT):
+    """This process's slice of an account-wide budget; 0 (unlimited tokens) stays 0"""
+    return {name: max(1, value // processes) if value else 0 for name, value in budget.items()}
+
+
+class Grant:
+    """A granted slot; release it when the call (or its stream) is finished"""
+    def __init__(self, limiter, user, tokens):
+        self.limiter = limiter
+        self.user = user
+        self.tokens = tokens
+        self.released = False
+
+    def record_usage(self, total_tokens):
+        """Return over-estimated tokens to the budget once actual usage is known"""
+        if total_tokens is not None and total_tokens < self.tokens:
+            self.limiter.tokens.give_back(self.tokens - total_tokens)
+            self.tokens = total_tokens
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter.release(self)
+
+
+class _ModelLimiter:
+    def __init__(self, model, budget):
+        self.model = model
+        self.requests = _TokenBucket(budget["rpm"])
+        self.tokens = _TokenBucket(budget["tpm"])
+        self.concurrency = budget["concurrency"]
+        self.in_flight = 0
+        self.in_flight_by_user = {}
+        self.last_served = {}  # user -> grant number, for round-robin between users
+        self._grants = itertools.count()
+        self.blocked_until = 0.0  # set from Retry-After so every caller backs off together
+        self.waiters = []
+        self._timer = None
+        self._seq = itertools.count()
+
+    def _pick(self):
+        # best priority first; within it, the user with the fewest calls running,
+        # then the one served least recently; then FIFO
+        return min(self.waiters, key=lambda w: (
+            w[0], self.in_flight_by_user.get(w[1], 0), self.last_served.get(w[1], -1), w[2]
+        ))
+
+    def dispatch(self):
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while self.waiters and self.in_flight < self.concurrency:
+            waiter = self._pick()
+            priority, user, seq, tokens, future, enqueued_at = waiter
+            delay = max(self.blocked_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if delay > 0:
+                self._schedule(delay)
+                break
+            self.waiters.remove(waiter)
+            if future.done():  # caller timed out or went away
+                continue
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            self.in_flight_by_user[user] = self.in_flight_by_user.get(user, 0) + 1
+            if len(self.last_served) > 10000:
+                self.last_served.clear()
+            self.last_served[user] = next(self._grants)
+            LLM_QUEUE_WAIT.labels(self.model, str(priority)).observe(now - enqueued_at)
+            future.set_result(Grant(self, user, tokens))
+        LLM_QUEUE_DEPTH.labels(self.model).set(len(self.waiters))
+        LLM_IN_FLIGHT.labels(self.model).set(self.in_flight)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self.dispatch)
+
+    async def acquire(self, priority, user, tokens):
+        if len(self.waiters) >= LLM_MAX_QUEUE:
+            LLM_REJECTIONS.labels(self.model, "queue_full").inc()
+            raise LLMUnavailable(f"{self.model} queue is full", retry_after=1)
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, user, next(self._seq), tokens, future, time.monotonic())
+        self.waiters.append(waiter)
+        self.dispatch()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), LLM_MAX_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            # dispatch() may have granted a slot in the same loop iteration as the timeout
+            if future.done() and not future.cancelled():
+                future.result().release()
+            else:
+                future.cancel()
+            LLM_REJECTIONS.labels(self.model, "timeout").inc()
+            LLM_QUEUE_DEPTH.labels(self.model).set(len(self.waiters))
+            raise LLMUnavailable(f"Timed out waiting for {self.model} capacity", retry_after=5)
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if future.done() and not future.cancelled():
+                future.result().release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self, grant):
+        self.in_flight -= 1
+        self.in_flight_by_user[grant.user] -= 1
+        if not self.in_flight_by_user[grant.user]:
+            del self.in_flight_by_user[grant.user]
+        self.dispatch()
+
+    def penalize(self, delay):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+
+class LLMGovernor:
+    """
+    Central gate in front of every OpenAI call.
+    Enforces per-model request/token budgets and concurrency, serves
+    interactive calls ahead of background work with fair sharing between
+    users, and retries transient failures with jittered backoff that
+    honors Retry-After.
+    """
+    def __init__(self, budgets=None, processes=LLM_PROCESS_COUNT):
+        self.budgets = budgets or LLM_BUDGETS
+        self.processes = processes
+        self._limiters = {}
+
+    def _limiter(self, model):
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = _ModelLimiter(model, process_share(self.budgets.get(model, FALLBACK_BUDGET), self.processes))
+            self._limiters[model] = limiter
+        return limiter
+
+    def _backoff(self, model, attempt, error):
+        retry_after = retry_after_seconds(error)
+        if isinstance(error, openai.RateLimitError):
+            LLM_RETRIES.labels(model, "rate_limited").inc()
+            # everyone waiting on this model pauses, not just this caller
+            self._limiter(model).penalize(retry_after or 1.0)
+        else:
+            LLM_RETRIES.labels(model, type(error).__name__).inc()
+        delay = min(20.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.5)
+        return max(delay, retry_after or 0.0)
+
+    async def _attempts(self, model, fn, estimated_tokens, priority, user, keep_slot):
+        limiter = self._limiter(model)
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            grant = await limiter.acquire(priority, user, estimated_tokens)
+            try:
+                result = await fn()
+            except RETRYABLE_ERRORS as e:
+                grant.release()
+                if attempt == LLM_MAX_ATTEMPTS - 1:
+                    LLM_REJECTIONS.labels(model, "retries_exhausted").inc()
+                    raise LLMUnavailable(f"{model} is unavailable: {e}", retry_after=retry_after_seconds(e))
+                await asyncio.sleep(self._backoff(model, attempt, e))
+                continue
+            except BaseException:
+                grant.release()
+                raise
+            if keep_slot:
+                return result, grant
+            usage = getattr(result, "usage", None)
+            grant.record_usage(getattr(usage, "total_tokens", None))
+            grant.release()
+            return result
+
+    async def call(self, model, fn, estimated_tokens=1000, priority=INTERACTIVE, user=None):
+        """Run `fn` (an async callable making one OpenAI request) under the model's budget"""
+        return await self._attempts(model, fn, estimated_tokens, priority, user, keep_slot=False)
+
+    async def open_stream(self, model, fn, estimated_tokens=1000, priority=INTERACTIVE, user=None):
+        """
+        Like call() for streaming requests: retries only while opening the stream.
+        Returns (stream, grant); the caller releases the grant when the stream ends.
+        """
+        return await self._attempts(model, fn, estimated_tokens, priority, user, keep_slot=True)
+
+
+governor = LLMGovernor()
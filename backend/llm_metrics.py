@@ -0,0 +1,140 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Histogram
+
+# Every OpenAI call is labeled with model, endpoint and prompt template.
+# The endpoint comes from the request being served (set by the HTTP middleware
+# and the audio websocket); background work can relabel itself with llm_endpoint_scope.
+llm_endpoint = ContextVar("llm_endpoint", default="none")
+
+# USD per 1M tokens (whisper: per audio minute); override with LLM_PRICES='{"gpt-4o": {"input": 2.5, ...}}'
+DEFAULT_LLM_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-2024-05-13": {"input": 5.00, "cached_input": 5.00, "output": 15.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "whisper-1": {"audio_minute": 0.006},
+}
+LLM_PRICES = {**DEFAULT_LLM_PRICES, **json.loads(os.getenv("LLM_PRICES", "{}"))}
+
+LABELS = ["model", "endpoint", "template"]
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+LLM_PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "Prompt tokens sent to OpenAI", LABELS)
+LLM_CACHED_PROMPT_TOKENS = Counter(
+    "llm_cached_prompt_tokens_total", "Prompt tokens served from OpenAI's prompt cache", LABELS
+)
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "Completion tokens generated by OpenAI", LABELS)
+LLM_CACHED_PROMPT_RATIO = Histogram(
+    "llm_cached_prompt_ratio", "Share of a request's prompt tokens that were cached", LABELS,
+    buckets=(0, 0.1, 0.25, 0.5, 0.75, 0.9, 1)
+)
+LLM_COST = Counter("llm_estimated_cost_usd_total", "Estimated OpenAI spend from reported usage and LLM_PRICES", LABELS)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Time from sending an OpenAI request to its last byte (excludes governor queueing)",
+    LABELS, buckets=LATENCY_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time from sending a streaming request to its first content token",
+    LABELS, buckets=LATENCY_BUCKETS
+)
+LLM_INTER_TOKEN_LATENCY = Histogram(
+    "llm_inter_token_latency_seconds", "Gap between consecutive streamed content chunks", LABELS,
+    buckets=(0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.2, 0.5, 1, 2)
+)
+LLM_OUTPUT_TOKENS_PER_SECOND = Histogram(
+    "llm_output_tokens_per_second", "Completion tokens per second once output has started", LABELS,
+    buckets=(5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+)
+
+
+@contextmanager
+def llm_endpoint_scope(endpoint):
+    """Label OpenAI calls made (and tasks started) inside the block with `endpoint`"""
+    token = llm_endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        llm_endpoint.reset(token)
+
+
+def _labels(metric, model, template):
+    return metric.labels(model, llm_endpoint.get(), template or "none")
+
+
+def record_usage(model, template, usage):
+    """Export the token usage OpenAI reports for one request, and its estimated cost"""
+    if usage is None:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    _labels(LLM_PROMPT_TOKENS, model, template).inc(prompt_tokens)
+    _labels(LLM_CACHED_PROMPT_TOKENS, model, template).inc(cached_tokens)
+    _labels(LLM_COMPLETION_TOKENS, model, template).inc(completion_tokens)
+    if prompt_tokens:
+        _labels(LLM_CACHED_PROMPT_RATIO, model, template).observe(cached_tokens / prompt_tokens)
+    prices = LLM_PRICES.get(model)
+    if prices and "input" in prices:
+        cost = (
+            (prompt_tokens - cached_tokens) * prices["input"]
+            + cached_tokens * prices.get("cached_input", prices["input"])
+            + completion_tokens * prices["output"]
+        ) / 1_000_000
+        _labels(LLM_COST, model, template).inc(cost)
+
+
+async def observe_completion(model, template, create):
+    """Await one non-streaming completion and export its latency, output rate, usage and cost"""
+    started = time.monotonic()
+    completion = await create
+    elapsed = time.monotonic() - started
+    _labels(LLM_REQUEST_DURATION, model, template).observe(elapsed)
+    usage = completion.usage
+    if usage is not None and usage.completion_tokens and elapsed > 0:
+        _labels(LLM_OUTPUT_TOKENS_PER_SECOND, model, template).observe(usage.completion_tokens / elapsed)
+    record_usage(model, template, usage)
+    return completion
+
+
+def observe_transcription(model, seconds, audio_seconds):
+    """Export the latency of one speech-to-text request and its cost by audio length"""
+    _labels(LLM_REQUEST_DURATION, model, "transcription").observe(seconds)
+    price = LLM_PRICES.get(model, {}).get("audio_minute")
+    if price and audio_seconds:
+        _labels(LLM_COST, model, "transcription").inc(audio_seconds / 60 * price)
+
+
+class StreamTimer:
+    """Timing for one streaming completion: call start() when the request is sent and piece() per content chunk"""
+    def __init__(self, model, template):
+        self.model = model
+        self.template = template
+        self.started = None
+        self.first = None
+        self.last = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.first = self.last = None
+
+    def piece(self):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+            _labels(LLM_TIME_TO_FIRST_TOKEN, self.model, self.template).observe(now - self.started)
+        else:
+            _labels(LLM_INTER_TOKEN_LATENCY, self.model, self.template).observe(now - self.last)
+        self.last = now
+
+    def finish(self, usage):
+        """The stream ended normally; `usage` is the final chunk's usage (or None)"""
+        _labels(LLM_REQUEST_DURATION, self.model, self.template).observe(time.monotonic() - self.started)
+        if usage is not None and usage.completion_tokens and self.first is not None and self.last > self.first:
+            # the first token's cost is in TTFT; the rate covers the tokens after it
+            rate = (usage.completion_tokens - 1) / (self.last - self.first)
+            _labels(LLM_OUTPUT_TOKENS_PER_SECOND, self.model, self.template).observe(rate)
+        record_usage(self.model, self.template, usage)
@@ -2,10 +2,10 @@ import openai
 import os
 import json
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends, Body, File, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Depends, Body, File, UploadFile, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from healthcare import Healthcare, User, Login, send_email
+from healthcare import Healthcare, User, Login, send_email, build_post_system_prompt
 from db import get_user_by_email, insert_user, update_user
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
@@ -15,16 +15,20 @@ import random
 from fastapi.responses import StreamingResponse
 from pymongo import MongoClient
 from fastapi import APIRouter
-from utils import (
-    generate_openai_response_stream,
-    speech_to_text_with_vad,
-    pcm_to_wav, 
-    combine_audio_streams_with_vad
+from utils import generate_openai_response_stream, init_openai_client, close_openai_client, post_stream_request, stream_content, open_post_stream, post_stream_flight
+from post_speculation import PostSpeculator
+from resumable_stream import ResumableStreams
+from content_calendar import (
+    calendar_size, derive_topics, generate_calendar_posts, hooks_for_topics,
+    build_batch_file, submit_batch, fetch_batch_results, CALENDAR_MAX_POSTS
 )
+from llm_governor import LLMUnavailable
+from contextlib import asynccontextmanager
 from fastapi import Depends, HTTPException
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import time
+import weakref
 from pathlib import Path
 import shutil
 from fastapi.staticfiles import StaticFiles
@@ -42,6 +46,7 @@ from typing import List, Optional
 
 from prometheus_fastapi_instrumentator import Instrumentator
 from prometheus_client import Counter, Histogram, generate_latest
+from llm_metrics import llm_endpoint_scope
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 
@@ -84,8 +89,14 @@ class UserProfileForm(BaseModel):
 
 # Add these near the top of your file with other imports and configure
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
-storage_client = storage.Client()
-bucket = storage_client.bucket(GCS_BUCKET_NAME)
+_bucket = None
+
+def get_bucket():
+    """The GCS client is created on first use instead of at import, keeping worker startup fast"""
+    global _bucket
+    if _bucket is None:
+        _bucket = storage.Client().bucket(GCS_BUCKET_NAME)
+    return _bucket
 
 # OTP store - In-memory store for OTPs
 otp_store = {}  # {email: otp}
@@ -102,6 +113,7 @@ users_collection = db["users"]
 saved_posts_collection = db["saved_posts"]
 session_collection = db["sessions"]
 transcription_collection = db["transcriptions"]
+calendar_batches_collection = db["content_calendar_batches"]
 
 # database indexes
 def setup_post_indexes():
@@ -115,19 +127,21 @@ def setup_post_indexes():
 # setup_post_indexes()
 
 
-# OpenAI API Key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client_openai = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
-
 # Security dependencies
 security_bearer = HTTPBearer()
 
 # Instantiate the Healthcare class
 healthcare = Healthcare()
+# Pre-generates posts for the top hooks while the user is choosing
+post_speculator = PostSpeculator()
+# SSE post streams buffered for Last-Event-ID resume
+resumable_streams = ResumableStreams()
 
 # Define HookRequest
 class HookRequest(BaseModel):
     user_input: str 
+    bypass_cache: bool = False  # force fresh hooks instead of a cached result
+    speculate: bool = True  # pre-generate posts for the top hooks
     
 # Define the request models for saving and updating posts
 class SavePostRequest(BaseModel):
@@ -144,6 +158,10 @@ class PostFilter(BaseModel):
     tag: Optional[str] = None
     search: Optional[str] = None
 
+class ContentCalendarRequest(BaseModel):
+    topics: Optional[List[str]] = None  # derived from the user profile when omitted
+    offline: bool = False  # submit the posts as an OpenAI Batch API job instead of generating now
+
 # Define PostRequest (empty - no params needed)
 class PostRequest(BaseModel):
     pass  # No fields needed as we use stored state
@@ -160,8 +178,15 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         )
     return user
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared, pooled OpenAI client for every LLM and STT call
+    init_openai_client()
+    yield
+    await close_openai_client()
+
 # FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware setup
 app.add_middleware(
@@ -194,14 +219,59 @@ def select_template(template_number: int, user=Depends(get_current_user)):
 async def generate_hooks_endpoint(request: HookRequest, current_user: dict = Depends(get_current_user)):
     """Third step: Generate hook options based on user input"""
     # Now passing the user email to store hooks in the Healthcare class
-    hooks = await healthcare.generate_hooks(request.user_input, current_user["email"])
+    hooks = await healthcare.generate_hooks(
+        request.user_input, current_user["email"], use_cache=not request.bypass_cache
+    )
     if not hooks:
         raise HTTPException(status_code=400, detail="No hooks generated. Please try again.")
     
+    if request.speculate:
+        speculate_posts(current_user, request.user_input, hooks)
+
     numbered_hooks = [{"number": i + 1, "hook": hook} for i, hook in enumerate(hooks)]
     return {"hooks": numbered_hooks}
 
 
+@healthcare_router.post("/generate_hooks/stream")
+async def generate_hooks_stream(request: HookRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Streaming version of hook generation: one NDJSON line {"number", "hook"}
+    per hook, sent as soon as the model has finished writing it.
+    """
+    hook_stream = healthcare.stream_hooks(
+        request.user_input, current_user["email"], use_cache=not request.bypass_cache
+    )
+    # wait for the first hook so failures still get a proper status code
+    try:
+        first_hook = await hook_stream.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="No hooks generated. Please try again.")
+
+    async def lines():
+        hooks = [first_hook]
+        try:
+            yield json.dumps({"number": 1, "hook": first_hook}) + "\n"
+            async for hook in hook_stream:
+                hooks.append(hook)
+                yield json.dumps({"number": len(hooks), "hook": hook}) + "\n"
+        finally:
+            await hook_stream.aclose()
+        if request.speculate:
+            speculate_posts(current_user, request.user_input, hooks)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def speculate_posts(current_user, user_input, hooks):
+    """Start speculative posts for freshly generated hooks (needs a selected template)"""
+    if not healthcare.selected_template:
+        return
+    post_speculator.start(current_user, [
+        (i + 1, build_post_system_prompt(healthcare.selected_template, hook, current_user), user_input)
+        for i, hook in enumerate(hooks)
+    ], template=healthcare.selected_template.prompt.key)
+
+
 
 # Step 4: Select a hook
 @healthcare_router.post("/select_hook")
@@ -211,6 +281,7 @@ def select_hook(hook_number: int, user=Depends(get_current_user)):
     success = healthcare.select_hook(user["email"], hook_number)
     if not success:
         raise HTTPException(status_code=400, detail="No hooks found or invalid hook number")
+    post_speculator.select(user["email"], hook_number)
     
     return {"message": "Hook selected successfully", "hook_number": hook_number}
 
@@ -254,9 +325,30 @@ def select_hook(hook_number: int, user=Depends(get_current_user)):
 #     content_generator = await generate_openai_response_stream(system_prompt, user_input)
 #     return StreamingResponse(content_generator(), media_type="text/plain")
 
+# keep proxies from buffering or caching server-sent events
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 @healthcare_router.post("/generate_linkedin_post/stream")
-async def generate_post_stream(current_user: dict = Depends(get_current_user)):
-    """Streaming version of the final post generation using stored state"""
+async def generate_post_stream(request: Request, persist: bool = False, current_user: dict = Depends(get_current_user)):
+    """
+    Streaming version of the final post generation using stored state.
+    Send `Accept: text/event-stream` for resumable SSE; after a dropped
+    connection, repeat the request with `Last-Event-ID` to continue.
+    With `persist=true` the finished post is saved as a draft and its id
+    is sent after the text.
+    """
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    last_event_id = request.headers.get("last-event-id")
+    if sse and last_event_id:
+        resumed = resumable_streams.resume(current_user["email"], last_event_id)
+        if resumed is None:
+            raise HTTPException(status_code=410, detail="Stream expired. Please generate the post again.")
+        stream_id, fanout, offset = resumed
+        return StreamingResponse(
+            resumable_streams.event_stream(fanout, stream_id, offset, request)(),
+            media_type="text/event-stream", headers=SSE_HEADERS
+        )
+
     # Check if template was selected
     if not healthcare.selected_template:
         raise HTTPException(status_code=400, detail="No template selected. Please select a template first.")
@@ -283,46 +375,224 @@ async def generate_post_stream(current_user: dict = Depends(get_current_user)):
     
     hook = hooks[selected_hook_number - 1]
     
-    # Define post length based on user profile or default to "medium"
-    post_length = "500"  # Default value
-    if "profile" in current_user and "preferred_post_length" in current_user["profile"]:
-        if current_user["profile"]["preferred_post_length"] == "short":
-            post_length = "300"
-        elif current_user["profile"]["preferred_post_length"] == "medium":
-            post_length = "500"
-        elif current_user["profile"]["preferred_post_length"] == "long":
-            post_length = "800"
-    
-    # Extract template details
-    template = {
-        "description": selected_template.description,
-        "style": getattr(selected_template, "style", "Professional")  # Default to Professional if not defined
-    }
+    system_prompt = build_post_system_prompt(selected_template, hook, current_user)
     
-    # Enhanced system prompt
-    system_prompt = f"""
-    You are an AI assistant specialized in generating healthcare-specific LinkedIn posts that captivate and engage healthcare professionals. Use the doctor's spoken topic and the following inputs to craft each post:
-    Template description: {template["description"]}
-    Selected hook: {hook}
-    Style: {template["style"]}
-    Target length: {post_length} words
-    Follow these guidelines to create a high-impact LinkedIn post:
-    Hook: Start with a compelling first line (max. 8 words) that hints at a personal insight or surprising fact to spark curiosity
-    Structure: Deliver immediate value in concise paragraphs or list format; keep the post to five or fewer paragraphs
-    Insight: Include a credible statistic, myth‑busting fact or reference to a current health trend (e.g. #HealthyEatingWeek, #MentalHealthAwareness) that's relevant to the topic
-    Engagement: End the main text with an open-ended question to invite comments and professional discussion, encouraging meaningful interaction
-    Hashtags: Select exactly three relevant, timely healthcare hashtags; avoid over-tagging (3–5 hashtags is optimal)
-    Tone: Maintain a professional yet conversational tone; weave in warmth or gentle humor when appropriate to humanize the message
-    Sources: At the end of the post, after the call to action, include a separate line beginning with "Quellen:" followed by the sources you referenced. List each source explicitly and separate them by semicolons or line breaks.
-    Compliance: Do not include any protected health information or identifiable patient details; stay compliant with privacy regulations
-    
-    IMPORTANT: Return the post in plain text format, not JSON. Include the hashtags at the end of the post.
-    
-    Use the {hook} naturally in the content and reflect the specified {template["style"]}.
+    # a post pre-generated for this hook streams straight from its buffer
+    key, _ = post_stream_request(system_prompt, user_input)
+    fanout = post_speculator.take(current_user["email"], selected_hook_number, key)
+    if fanout is not None:
+        post_stream_flight.adopt(key, fanout)  # a double click or retry joins it instead of starting another
+    else:
+        try:
+            fanout = await open_post_stream(
+                system_prompt, user_input, user=current_user["email"], template=selected_template.prompt.key
+            )
+        except LLMUnavailable as e:
+            headers = {"Retry-After": str(int(e.retry_after))} if e.retry_after else None
+            raise HTTPException(status_code=503, detail="Post generation is busy. Please retry shortly.", headers=headers)
+
+    saved = None
+    if persist:
+        saved = persist_when_finished(fanout, build_post_document(
+            current_user["email"], None, selected_template, hook, user_input
+        ))
+
+    if sse:
+        stream_id = resumable_streams.register(current_user["email"], fanout, saved)
+        return StreamingResponse(
+            resumable_streams.event_stream(fanout, stream_id, request=request)(),
+            media_type="text/event-stream", headers=SSE_HEADERS
+        )
+    # passing the request lets a client disconnect close the upstream stream
+    return StreamingResponse(stream_content(fanout, request, saved)(), media_type="text/plain")
+
+def build_post_document(user_email, content, selected_template, hook, user_input, tags=None):
+    """Saved post document, shared by /posts/save and stream-and-persist"""
+    return {
+        "user_email": user_email,
+        "content": content,
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+        "status": "draft",
+        "generation_metadata": {
+            "template_name": getattr(selected_template, 'name', 'Unknown'),
+            "hook": hook,
+            "user_input": user_input,
+            "generated_at": datetime.now()
+        },
+        "tags": tags if tags is not None else [],
+        "character_count": len(content) if content is not None else 0
+    }
+
+# strong references to in-flight background saves
+_persist_tasks = set()
+# fanout -> {user email: saved-post future}; coalesced requests save one draft per user
+_persisted_fanouts = weakref.WeakKeyDictionary()
+
+def persist_when_finished(fanout, post_data):
     """
-    
-    content_generator = await generate_openai_response_stream(system_prompt, user_input)
-    return StreamingResponse(content_generator(), media_type="text/plain")
+    Insert `post_data` as a draft once the stream completes, independently of the client.
+    Returns a future with the new post id (None if the stream did not finish).
+    Requests of the same user sharing `fanout` get the same future and the same post;
+    other users coalesced onto it (identical prompts) get their own draft.
+    """
+    per_user = _persisted_fanouts.setdefault(fanout, {})
+    if post_data["user_email"] in per_user:
+        return per_user[post_data["user_email"]]
+    loop = asyncio.get_running_loop()
+    saved = per_user[post_data["user_email"]] = loop.create_future()
+
+    async def insert(content):
+        try:
+            post_data["content"] = content
+            post_data["character_count"] = len(content)
+            post_data["updated_at"] = post_data["generation_metadata"]["generated_at"] = datetime.now()
+            result = await asyncio.to_thread(saved_posts_collection.insert_one, post_data)
+            saved.set_result(str(result.inserted_id))
+        except Exception as e:
+            print(f"Failed to save streamed post: {e}")
+            saved.set_result(None)
+
+    def on_done(fanout):
+        if fanout.error is not None or not fanout.pieces:
+            saved.set_result(None)
+            return
+        task = loop.create_task(insert("".join(fanout.pieces)))
+        _persist_tasks.add(task)
+        task.add_done_callback(_persist_tasks.discard)
+
+    fanout.add_done_callback(on_done)
+    return saved
+
+# Batch content calendar
+@healthcare_router.post("/content_calendar")
+async def generate_content_calendar(request: ContentCalendarRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Generate hooks and posts for several topics at once and store them as drafts.
+    Streams one JSON line per finished post (with its "post_id" once saved),
+    then {"saved": [post ids]}. Each post is saved as soon as it is generated,
+    and generation carries on if the client disconnects.
+    With offline=true the posts are submitted as a Batch API job instead;
+    poll /content_calendar/batch/{batch_id} to import them.
+    """
+    if not healthcare.selected_template:
+        raise HTTPException(status_code=400, detail="No template selected. Please select a template first.")
+    selected_template = healthcare.selected_template
+    profile = current_user.get("profile", {})
+
+    topics = request.topics
+    if not topics:
+        try:
+            topics = await derive_topics(profile, calendar_size(profile), current_user["email"])
+        except LLMUnavailable:
+            raise HTTPException(status_code=503, detail="Topic generation is busy. Please retry shortly.")
+        except Exception as e:
+            print(f"Error deriving calendar topics: {e}")
+            topics = []
+    topics = topics[:CALENDAR_MAX_POSTS]
+    if not topics:
+        raise HTTPException(status_code=400, detail="No topics to generate. Please provide topics.")
+
+    if request.offline:
+        pairs = await hooks_for_topics(healthcare, current_user, topics)
+        if not pairs:
+            raise HTTPException(status_code=400, detail="No hooks generated. Please try again.")
+        items = [{"custom_id": f"post-{i}", "topic": topic, "hook": hook} for i, (topic, hook) in enumerate(pairs)]
+        try:
+            batch = await submit_batch(build_batch_file(items, selected_template, current_user))
+        except Exception as e:
+            print(f"Error submitting calendar batch: {e}")
+            raise HTTPException(status_code=502, detail="Could not submit the batch job.")
+        await asyncio.to_thread(calendar_batches_collection.insert_one, {
+            "_id": batch.id,
+            "user_email": current_user["email"],
+            "template_name": selected_template.name,
+            "items": items,
+            "created_at": datetime.now()
+        })
+        return {"batch_id": batch.id, "status": batch.status, "topics": [item["topic"] for item in items]}
+
+    finished = asyncio.Queue()
+
+    async def generate_and_save():
+        # a background task, so a dropped connection does not discard generated posts
+        post_ids = []
+        try:
+            async for result in generate_calendar_posts(healthcare, current_user, topics, selected_template):
+                if "content" in result:
+                    try:
+                        inserted = await asyncio.to_thread(saved_posts_collection.insert_one, build_post_document(
+                            current_user["email"], result["content"], selected_template,
+                            result["hook"], result["topic"], ["content_calendar"]
+                        ))
+                        result["post_id"] = str(inserted.inserted_id)
+                        post_ids.append(result["post_id"])
+                    except Exception as e:
+                        print(f"Failed to save calendar post for '{result['topic']}': {e}")
+                finished.put_nowait(result)
+        finally:
+            finished.put_nowait({"saved": post_ids})
+
+    task = asyncio.create_task(generate_and_save())
+    _persist_tasks.add(task)
+    task.add_done_callback(_persist_tasks.discard)
+
+    async def results():
+        while True:
+            result = await finished.get()
+            yield json.dumps(result) + "\n"
+            if "saved" in result:
+                return
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@healthcare_router.get("/content_calendar/batch/{batch_id}")
+async def content_calendar_batch(batch_id: str, current_user: dict = Depends(get_current_user)):
+    """Check an offline calendar job; once it has completed, its posts are saved as drafts"""
+    job = await asyncio.to_thread(
+        calendar_batches_collection.find_one, {"_id": batch_id, "user_email": current_user["email"]}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if "post_ids" in job:
+        return {"batch_id": batch_id, "status": "imported", "post_ids": job["post_ids"]}
+
+    status, results = await fetch_batch_results(batch_id)
+    if results is None:
+        return {"batch_id": batch_id, "status": status}
+
+    # only one poll imports the results
+    claimed = await asyncio.to_thread(
+        calendar_batches_collection.update_one,
+        {"_id": batch_id, "importing": {"$exists": False}}, {"$set": {"importing": True}}
+    )
+    if not claimed.modified_count:
+        return {"batch_id": batch_id, "status": "importing"}
+
+    try:
+        template = healthcare.templates.get(job["template_name"])
+        drafts = [
+            build_post_document(
+                current_user["email"], results[item["custom_id"]], template,
+                item["hook"], item["topic"], ["content_calendar"]
+            )
+            for item in job["items"] if results.get(item["custom_id"])
+        ]
+        post_ids = []
+        if drafts:
+            inserted = await asyncio.to_thread(saved_posts_collection.insert_many, drafts)
+            post_ids = [str(post_id) for post_id in inserted.inserted_ids]
+        await asyncio.to_thread(
+            calendar_batches_collection.update_one, {"_id": batch_id}, {"$set": {"post_ids": post_ids}}
+        )
+    except Exception as e:
+        print(f"Error importing calendar batch {batch_id}: {e}")
+        # release the claim so a later poll can retry the import
+        await asyncio.to_thread(
+            calendar_batches_collection.update_one, {"_id": batch_id}, {"$unset": {"importing": ""}}
+        )
+        raise HTTPException(status_code=500, detail="Could not import the batch results. Please poll again.")
+    return {"batch_id": batch_id, "status": "imported", "post_ids": post_ids}
 
 #Save Generated Post
 @healthcare_router.post("/posts/save")
@@ -343,21 +613,14 @@ async def save_generated_post(
         )
     
     # Create post document
-    post_data = {
-        "user_email": user["email"],
-        "content": request.content,
-        "created_at": datetime.now(),
-        "updated_at": datetime.now(),
-        "status": "draft",
-        "generation_metadata": {
-            "template_name": getattr(selected_template, 'name', 'Unknown'),
-            "hook": user_hooks_data["hooks"][user_hooks_data["selected_hook_number"] - 1],
-            "user_input": user_hooks_data["user_input"],
-            "generated_at": datetime.now()
-        },
-        "tags": request.tags,
-        "character_count": len(request.content)
-    }
+    post_data = build_post_document(
+        user["email"],
+        request.content,
+        selected_template,
+        user_hooks_data["hooks"][user_hooks_data["selected_hook_number"] - 1],
+        user_hooks_data["user_input"],
+        request.tags
+    )
     
     result = saved_posts_collection.insert_one(post_data)
     
@@ -783,7 +1046,7 @@ async def upload_profile_picture(
             if "storage.googleapis.com" in old_url:
                 # URL format: https://storage.googleapis.com/bucket-name/path/to/file
                 old_blob_name = "/".join(old_url.split("/")[4:])
-                old_blob = bucket.blob(old_blob_name)
+                old_blob = get_bucket().blob(old_blob_name)
                 if old_blob.exists():
                     old_blob.delete()
         except Exception as e:
@@ -794,7 +1057,7 @@ async def upload_profile_picture(
     blob_name = f"profile_pictures/{unique_filename}"
     
     # Create a new blob in GCS
-    blob = bucket.blob(blob_name)
+    blob = get_bucket().blob(blob_name)
     
     try:
         # Read the file content
@@ -854,7 +1117,7 @@ async def delete_profile_picture(user=Depends(get_current_user)):
         # Extract the blob name from the URL
         # URL format: https://storage.googleapis.com/bucket-name/path/to/file
         blob_name = "/".join(profile_picture.split("/")[4:])
-        blob = bucket.blob(blob_name)
+        blob = get_bucket().blob(blob_name)
         if blob.exists():
             blob.delete()
     except Exception as e:
@@ -912,66 +1175,14 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security_be
         }
     }
 
-@app.websocket("/ws/audio")
-async def websocket_audio_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    audio_streams = []
-    
-    async def ping_client():
-        while True:
-            try:
-                await asyncio.sleep(10)
-                await websocket.send_json({"message": "ping"})
-            except Exception as e:
-                print(f"Ping error: {e}")
-                break
-
-    ping_task = asyncio.create_task(ping_client())
-    
-    try:
-        while True:
-            try:
-                message = await asyncio.wait_for(websocket.receive_json(), timeout=5.0)
-                t = time.time()
-                stream_bytes = message.get("stream_bytes")
-                
-                
-                if stream_bytes:
-                    audio_stream = base64.b64decode(stream_bytes)
-                    pcm_data = await pcm_to_wav(audio_stream)
-                    audio_streams.append(pcm_data)
-
-                    combined_audio = await combine_audio_streams_with_vad(audio_streams)
-
-                    if combined_audio is not None:
-                        transcription = await speech_to_text_with_vad(combined_audio)
-                        transcription = transcription.replace("\n", " ").strip()
-                        await websocket.send_json({
-                            "message": "Transcriptions Generated",
-                            "transcription": transcription
-                        })
-                        print(f"Transcription time: {time.time() - t} seconds")
-    
-            except asyncio.TimeoutError:
-                continue   
-            
-            except WebSocketDisconnect:
-                print("Client disconnected")
-                break
-            
-    except Exception as e:
-        print(f"Error in websocket loop: {e}")
-        try:
-            await websocket.close()
-        except:
-            pass
-    finally:
-        ping_task.cancel() 
-        audio_streams.clear()
-
 # Include healthcare router
 app.include_router(healthcare_router, prefix="/healthcare", tags=["Healthcare"])
 
+# Audio routes pull in torch and Silero; text-only workers can leave them out
+if os.getenv("ENABLE_AUDIO_ROUTES", "true").lower() == "true":
+    from audio_service import audio_router
+    app.include_router(audio_router)
+
 REQUEST_COUNT = Counter(
     "http_requests_total", "Total HTTP requests", ["method", "endpoint", "http_status"]
 )
@@ -983,7 +1194,8 @@ REQUEST_LATENCY = Histogram(
 async def prometheus_middleware(request, call_next):
     import time
     start = time.time()
-    response = await call_next(request)
+    with llm_endpoint_scope(request.url.path):  # labels the OpenAI calls this request makes
+        response = await call_next(request)
     REQUEST_COUNT.labels(request.method, request.url.path, response.status_code).inc()
     REQUEST_LATENCY.labels(request.method, request.url.path).observe(time.time() - start)
     return response
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from collections import deque
+from prometheus_client import Counter
+from single_flight import StreamFanout
+from utils import post_stream_request
+from llm_governor import BACKGROUND
+from llm_metrics import llm_endpoint_scope
+
+# Speculative post generation: once hooks are returned, posts for the first
+# hooks are generated in the background so the final step streams from a buffer.
+SPECULATIVE_POSTS = os.getenv("SPECULATIVE_POSTS", "true").lower() == "true"
+# Per-plan caps: how many hooks to pre-generate and how many speculative posts per hour.
+# Override with SPECULATIVE_POSTS_PLANS='{"pro": {"top_n": 5, "per_hour": 100}}'
+DEFAULT_SPECULATION_PLANS = {
+    "free": {"top_n": 1, "per_hour": 10},
+    "pro": {"top_n": 3, "per_hour": 60},
+}
+SPECULATION_PLANS = {**DEFAULT_SPECULATION_PLANS, **json.loads(os.getenv("SPECULATIVE_POSTS_PLANS", "{}"))}
+SPECULATIVE_POSTS_TTL_SECONDS = int(os.getenv("SPECULATIVE_POSTS_TTL_SECONDS", "600"))
+
+SPECULATIVE_POSTS_TOTAL = Counter(
+    "speculative_posts_total", "Speculative post generations by outcome", ["result"]
+)
+
+
+class _Speculation:
+    def __init__(self):
+        self.created_at = time.time()
+        self.streams = {}  # hook_number -> (request key, StreamFanout)
+
+    def cancel(self, keep=None):
+        for hook_number, (_, fanout) in self.streams.items():
+            if hook_number != keep and not fanout.done:
+                fanout.cancel()
+                SPECULATIVE_POSTS_TOTAL.labels("cancelled").inc()
+        self.streams = {n: s for n, s in self.streams.items() if n == keep}
+
+
+class PostSpeculator:
+    """
+    Pre-generates posts for a user's top hooks at background priority.
+    select() cancels the hooks that were not picked; take() hands the
+    picked stream to the post endpoint, which replays it from the start.
+    """
+    def __init__(self, plans=None):
+        self.plans = plans or SPECULATION_PLANS
+        self._speculations = {}  # email -> _Speculation
+        self._started = {}  # email -> deque of start times in the last hour
+
+    def _plan(self, user):
+        return self.plans.get(user.get("plan", "free"), self.plans["free"])
+
+    def _budget(self, email, per_hour):
+        started = self._started.setdefault(email, deque())
+        cutoff = time.time() - 3600
+        while started and started[0] < cutoff:
+            started.popleft()
+        return max(0, per_hour - len(started))
+
+    def _sweep(self):
+        cutoff = time.time() - SPECULATIVE_POSTS_TTL_SECONDS
+        for email in [e for e, s in self._speculations.items() if s.created_at < cutoff]:
+            self.discard(email)
+
+    def start(self, user, prompts, template=None):
+        """
+        Start speculative streams for `prompts`, a list of
+        (hook_number, system_prompt, user_input) ordered by preference;
+        `template` is the prompt template key used for usage metrics.
+        """
+        email = user["email"]
+        self.discard(email)
+        self._sweep()
+        if not SPECULATIVE_POSTS:
+            return
+        plan = self._plan(user)
+        count = min(plan["top_n"], self._budget(email, plan["per_hour"]), len(prompts))
+        if count < min(plan["top_n"], len(prompts)):
+            SPECULATIVE_POSTS_TOTAL.labels("over_budget").inc()
+        if not count:
+            return
+
+        speculation = _Speculation()
+        with llm_endpoint_scope("speculation"):  # not billed to the hooks endpoint that triggered it
+            for hook_number, system_prompt, user_input in prompts[:count]:
+                key, open_stream = post_stream_request(
+                    system_prompt, user_input, user=email, priority=BACKGROUND, template=template
+                )
+                speculation.streams[hook_number] = (key, StreamFanout(open_stream))
+                self._started[email].append(time.time())
+                SPECULATIVE_POSTS_TOTAL.labels("started").inc()
+        self._speculations[email] = speculation
+
+    def select(self, email, hook_number):
+        """The user picked a hook: stop generating posts for the others"""
+        speculation = self._speculations.get(email)
+        if speculation is not None:
+            speculation.cancel(keep=hook_number)
+
+    def take(self, email, hook_number, key):
+        """
+        Return the speculative stream for `hook_number` if it was generated
+        from the same request (template, hook, profile and input), else None.
+        """
+        speculation = self._speculations.pop(email, None)
+        if speculation is None:
+            return None
+        entry = speculation.streams.pop(hook_number, None)
+        speculation.cancel()
+        if entry is None or entry[0] != key:
+            if entry is not None:
+                entry[1].cancel()
+            SPECULATIVE_POSTS_TOTAL.labels("missed").inc()
+            return None
+        fanout = entry[1]
+        if fanout.error is not None and not fanout.pieces:
+            SPECULATIVE_POSTS_TOTAL.labels("failed").inc()
+            return None
+        SPECULATIVE_POSTS_TOTAL.labels("used").inc()
+        return fanout
+
+    def discard(self, email):
+        speculation = self._speculations.pop(email, None)
+        if speculation is not None:
+            speculation.cancel()
@@ -0,0 +1,87 @@
+import textwrap
+
+
+class PromptTemplate:
+    """
+    A prompt split into a static prefix, built once at startup, and a short
+    per-request suffix. Everything that varies goes at the end so OpenAI's
+    prompt cache can reuse the prefix across users and requests.
+    Bump `version` whenever the wording changes; it feeds cache keys.
+    """
+    def __init__(self, name, version, prefix, suffix):
+        self.name = name
+        self.version = version
+        self.key = f"{name}@{version}"
+        self.prefix = textwrap.dedent(prefix).strip() + "\n\n"
+        self.suffix = textwrap.dedent(suffix).strip()
+
+    def render(self, **values):
+        """The full prompt as one string (prefix first)"""
+        return self.prefix + self.suffix.format(**values)
+
+    def messages(self, **values):
+        """The prefix as the system message and the suffix as the user message"""
+        return [
+            {"role": "system", "content": self.prefix.strip()},
+            {"role": "user", "content": self.suffix.format(**values)}
+        ]
+
+
+POST_PROMPT_VERSION = "2"
+
+POST_INSTRUCTIONS = """
+You are an AI assistant specialized in generating healthcare-specific LinkedIn posts that captivate and engage healthcare professionals. Use the doctor's spoken topic and the inputs listed at the end to craft each post.
+Follow these guidelines to create a high-impact LinkedIn post:
+Hook: Start with a compelling first line (max. 8 words) that hints at a personal insight or surprising fact to spark curiosity
+Structure: Deliver immediate value in concise paragraphs or list format; keep the post to five or fewer paragraphs
+Insight: Include a credible statistic, myth‑busting fact or reference to a current health trend (e.g. #HealthyEatingWeek, #MentalHealthAwareness) that's relevant to the topic
+Engagement: End the main text with an open-ended question to invite comments and professional discussion, encouraging meaningful interaction
+Hashtags: Select exactly three relevant, timely healthcare hashtags; avoid over-tagging (3–5 hashtags is optimal)
+Tone: Maintain a professional yet conversational tone; weave in warmth or gentle humor when appropriate to humanize the message
+Sources: At the end of the post, after the call to action, include a separate line beginning with "Quellen:" followed by the sources you referenced. List each source explicitly and separate them by semicolons or line breaks.
+Compliance: Do not include any protected health information or identifiable patient details; stay compliant with privacy regulations
+
+IMPORTANT: Return the post in plain text format, not JSON. Include the hashtags at the end of the post.
+"""
+
+
+def compile_post_prompt(template):
+    """Post prompt for one Healthcare template: shared guidelines, then the template, then the request"""
+    style = getattr(template, "style", "Professional")
+    return PromptTemplate(
+        f"post.{template.name}",
+        POST_PROMPT_VERSION,
+        POST_INSTRUCTIONS + f"\nTemplate description: {template.description}\nStyle: {style}\n",
+        """
+        Selected hook: {hook}
+        Target length: {post_length} words
+        Use the selected hook naturally in the content and reflect the specified style.
+        """
+    )
+
+
+HOOK_PROMPT = PromptTemplate(
+    "hooks",
+    "3",
+    """
+    You are an AI assistant for generating catchy hooks for healthcare-specific LinkedIn posts.
+    Based solely on the user input that follows, generate 5 catchy hooks that are engaging, relevant, and tailored for healthcare professionals.
+    Return them in the "hooks" list, best first, each as plain text without numbering or surrounding quotes.
+    """,
+    "User input: '{user_input}'"
+)
+
+# Structured output: the model can only answer {"hooks": ["...", ...]}
+HOOK_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "hooks",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"hooks": {"type": "array", "items": {"type": "string"}}},
+            "required": ["hooks"],
+            "additionalProperties": False
+        }
+    }
+}
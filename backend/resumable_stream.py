@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+from utils import subscribe_until_disconnect
+
+# How long a generation stays buffered for reconnects, both after the client
+# drops mid-stream and after the model has finished
+RESUMABLE_STREAM_TTL_SECONDS = int(os.getenv("RESUMABLE_STREAM_TTL_SECONDS", "60"))
+RESUMABLE_STREAMS_MAX = int(os.getenv("RESUMABLE_STREAMS_MAX", "1000"))
+
+SSE_RESUMES = Counter("sse_stream_resumes_total", "Reconnects carrying Last-Event-ID", ["result"])
+SSE_BUFFERED_STREAMS = Gauge("sse_buffered_streams", "Generations buffered for SSE resume")
+
+
+def format_event(data, event_id=None, event=None):
+    """One server-sent event; multi-line data is split over several data: fields"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def _cancelled(fanout):
+    return isinstance(fanout.error, asyncio.CancelledError)
+
+
+class ResumableStreams:
+    """
+    Bounded registry of in-flight and recently finished generations.
+    Event ids are "<stream id>:<piece offset>", so a reconnect with
+    Last-Event-ID continues from the next piece of the same upstream call.
+    """
+    def __init__(self, ttl_seconds=RESUMABLE_STREAM_TTL_SECONDS, max_streams=RESUMABLE_STREAMS_MAX):
+        self.ttl_seconds = ttl_seconds
+        self.max_streams = max_streams
+        self._streams = OrderedDict()  # stream_id -> (user_email, StreamFanout, saved post id future or None)
+
+    def register(self, user_email, fanout, saved=None):
+        while len(self._streams) >= self.max_streams:
+            self._streams.popitem(last=False)  # oldest first; live subscribers keep streaming
+        stream_id = uuid.uuid4().hex
+        self._streams[stream_id] = (user_email, fanout, saved)
+        fanout.hold(self.ttl_seconds)
+        loop = asyncio.get_running_loop()
+
+        def on_done(fanout):
+            if _cancelled(fanout):
+                self._evict(stream_id)  # abandoned past the linger window: nothing left to resume
+            else:
+                loop.call_later(self.ttl_seconds, self._evict, stream_id)
+
+        fanout.add_done_callback(on_done)
+        SSE_BUFFERED_STREAMS.set(len(self._streams))
+        return stream_id
+
+    def _evict(self, stream_id):
+        self._streams.pop(stream_id, None)
+        SSE_BUFFERED_STREAMS.set(len(self._streams))
+
+    def resume(self, user_email, last_event_id):
+        """Return (stream_id, fanout, offset) to continue from, or None if it expired"""
+        stream_id, _, offset = last_event_id.strip().partition(":")
+        entry = self._streams.get(stream_id)
+        if entry is None or entry[0] != user_email or not offset.isdigit() or _cancelled(entry[1]):
+            SSE_RESUMES.labels("expired").inc()
+            return None
+        SSE_RESUMES.labels("resumed").inc()
+        return stream_id, entry[1], int(offset) + 1
+
+    def event_stream(self, fanout, stream_id, offset=0, request=None):
+        """
+        SSE generator for StreamingResponse, ending with a `done` (or `error`) event.
+        If the post is being persisted, a `saved` event with its id precedes `done`.
+        """
+        entry = self._streams.get(stream_id)
+        saved = entry[2] if entry is not None else None
+
+        async def event_generator():
+            position = offset
+            try:
+                async for piece in subscribe_until_disconnect(fanout, request, offset):
+                    yield format_event(piece, f"{stream_id}:{position}")
+                    position += 1
+            except asyncio.CancelledError as e:
+                if e is not fanout.error:
+                    raise  # this response itself was cancelled
+                print("Post stream was cancelled upstream")
+                yield format_event("Post generation was cancelled", event="error")
+                return
+            except Exception as e:
+                print(f"Post stream failed: {e}")
+                yield format_event("Post generation failed", event="error")
+                return
+            if fanout.done:
+                post_id = await asyncio.shield(saved) if saved is not None else None
+                if post_id:
+                    yield format_event(json.dumps({"post_id": post_id}), event="saved")
+                yield format_event("", event="done")
+
+        return event_generator
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+from prometheus_client import Counter
+
+LLM_COALESCED_REQUESTS = Counter(
+    "llm_coalesced_requests_total", "LLM requests served by an identical in-flight call", ["kind"]
+)
+
+
+def request_key(*parts):
+    """Stable key for an upstream request built from its model, prompts and options"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical coroutine calls: the first caller for a key
+    starts the work, everyone arriving while it runs awaits the same result.
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        self._calls = {}  # key -> asyncio.Task
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is not None:
+            LLM_COALESCED_REQUESTS.labels(self.kind).inc()
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        # shield: one caller giving up must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+class StreamFanout:
+    """
+    Runs one upstream stream and replays it to any number of subscribers.
+    Pieces are kept for the stream's lifetime so a subscriber that joins late
+    still receives everything from the start (or from a given offset).
+    When the last subscriber leaves before the end, the upstream is cancelled,
+    unless hold() keeps it running for clients expected to reconnect.
+    """
+    def __init__(self, open_stream):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.linger = 0
+        self._linger_timer = None
+        self._started = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._pump(open_stream))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, open_stream):
+        try:
+            source = await open_stream()
+            self._started.set()
+            async for piece in source:
+                self.pieces.append(piece)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._started.set()
+            self._notify()
+
+    def hold(self, seconds):
+        """Keep the upstream running for `seconds` after the last subscriber leaves"""
+        self.linger = max(self.linger, seconds)
+
+    def add_done_callback(self, fn):
+        self._task.add_done_callback(lambda _: fn(self))
+
+    def _cancel_if_abandoned(self):
+        self._linger_timer = None
+        if not self.subscribers and not self.done:
+            self.cancel()
+
+    def cancel(self):
+        """Stop the upstream stream; anyone still subscribed sees it end with CancelledError"""
+        if not self.done:
+            self.error = asyncio.CancelledError()
+            self.done = True  # no new subscribers; StreamFlight starts a fresh stream instead
+            self._task.cancel()
+            self._notify()
+
+    async def wait_started(self):
+        """Wait until the upstream call is open; re-raises if it could not be started"""
+        await self._started.wait()
+        if self.error is not None and not self.pieces:
+            raise self.error
+
+    async def subscribe(self, offset=0, stop=None):
+        """Yield pieces from `offset`; setting the `stop` event (e.g. on client disconnect) ends the subscription"""
+        self.subscribers += 1
+        if self._linger_timer is not None:  # a client came back in time
+            self._linger_timer.cancel()
+            self._linger_timer = None
+        try:
+            while True:
+                while offset < len(self.pieces):
+                    yield self.pieces[offset]
+                    offset += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                if stop is None:
+                    await self._changed.wait()
+                    continue
+                changed = asyncio.ensure_future(self._changed.wait())
+                stopped = asyncio.ensure_future(stop.wait())
+                try:
+                    await asyncio.wait({changed, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+                    stopped.cancel()
+                if stop.is_set():
+                    return
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                if self.linger:
+                    self._linger_timer = asyncio.get_running_loop().call_later(self.linger, self._cancel_if_abandoned)
+                else:
+                    self.cancel()  # nobody is listening any more: stop paying for tokens
+
+
+class StreamFlight:
+    """Single-flight for streams: identical concurrent requests share one StreamFanout"""
+    def __init__(self, kind):
+        self.kind = kind
+        self._streams = {}  # key -> StreamFanout
+
+    async def open(self, key, open_stream):
+        fanout = self._streams.get(key)
+        if fanout is not None and not fanout.done:
+            LLM_COALESCED_REQUESTS.labels(self.kind).inc()
+        else:
+            fanout = StreamFanout(open_stream)
+            self._streams[key] = fanout
+            fanout.add_done_callback(lambda _: self._forget(key, fanout))
+        await fanout.wait_started()
+        return fanout
+
+    def adopt(self, key, fanout):
+        """Let identical requests join `fanout`, a stream started elsewhere (e.g. speculatively)"""
+        current = self._streams.get(key)
+        if fanout.done or (current is not None and not current.done):
+            return
+        self._streams[key] = fanout
+        fanout.add_done_callback(lambda _: self._forget(key, fanout))
+
+    def _forget(self, key, fanout):
+        if self._streams.get(key) is fanout:
+            del self._streams[key]
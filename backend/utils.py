@@ -1,191 +1,279 @@
 import io
+import wave
+import json
 import openai
-from openai import OpenAI
+import httpx
 from fastapi import UploadFile
 import os
 from dotenv import load_dotenv
-import wave
-from io import BytesIO
 from pymongo import MongoClient
-from pydub import AudioSegment
 import random
-import torch
-import torchaudio
-import numpy as np
-from silero_vad import load_silero_vad, get_speech_timestamps
 import time
+import asyncio
+from single_flight import StreamFlight, request_key
+from llm_governor import governor, estimate_tokens, INTERACTIVE, BACKGROUND
+from llm_metrics import observe_completion, observe_transcription, StreamTimer
+from hedging import hedged_first_piece
+from prometheus_client import Counter
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 if not OPENAI_API_KEY:
     raise ValueError("OpenAI API key is missing. Please set the OPENAI_API_KEY environment variable.")
 
-client = openai
+# One pooled async client carries all chat and Whisper traffic
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+_client_openai = None
 
-client.api_key = OPENAI_API_KEY
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client_openai = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-vad_model = load_silero_vad()
-
-async def pcm_to_wav(pcm_bytes, sample_rate=16000, channels=1, sample_width=2):
-    buffer = BytesIO()
-    with wave.open(buffer, 'wb') as wf:
-        wf.setnchannels(channels)
-        wf.setsampwidth(sample_width)
-        wf.setframerate(sample_rate)
-        wf.writeframes(pcm_bytes)
-    return buffer.getvalue()
-
-async def combine_audio_streams(audio_streams):
-    """Combine multiple WAV audio streams into one WAV file"""
-    combined_audio = AudioSegment.empty()
-    for audio_stream in audio_streams:
-        audio_segment = AudioSegment.from_wav(io.BytesIO(audio_stream))
-        combined_audio += audio_segment
-    wav_buffer = io.BytesIO()
-    combined_audio.export(wav_buffer, format="wav")
-    wav_bytes = wav_buffer.getvalue()
-    return wav_bytes
-
-async def detect_speech_segments(audio_bytes, sample_rate=16000):
-    """
-    Use Silero VAD to detect speech segments in audio
-    Returns list of speech timestamps and filtered audio
-    """
+def _http2_available():
     try:
-        if isinstance(audio_bytes, bytes):
-            audio_np = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32768.0
-            audio_tensor = torch.from_numpy(audio_np)
-        else:
-            audio_tensor = audio_bytes
-        
-        if sample_rate != 16000:
-            resampler = torchaudio.transforms.Resample(sample_rate, 16000)
-            audio_tensor = resampler(audio_tensor)
-        
-        speech_timestamps = get_speech_timestamps(
-            audio_tensor, 
-            vad_model,
-            sampling_rate=16000,
-            threshold=0.5,
-            min_speech_duration_ms=250, 
-            min_silence_duration_ms=100, 
-            return_seconds=False  
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def init_openai_client():
+    """Create the shared client; called from the app lifespan"""
+    global _client_openai
+    if _client_openai is None:
+        http_client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0)
         )
-        
-        if not speech_timestamps:
-            return None, None
-
-        speech_chunks = []
-        for segment in speech_timestamps:
-            start_sample = segment['start']
-            end_sample = segment['end']
-            speech_chunks.append(audio_tensor[start_sample:end_sample])
-
-        if speech_chunks:
-            filtered_audio = torch.cat(speech_chunks, dim=0)
-            return speech_timestamps, filtered_audio
-        else:
-            return None, None
-            
-    except Exception as e:
-        print(f"VAD error: {e}")
-
-async def tensor_to_wav_bytes(audio_tensor, sample_rate=16000):
-    """Convert torch tensor to WAV bytes"""
-    if audio_tensor.dtype != torch.float32:
-        audio_tensor = audio_tensor.float()
-    
-    audio_tensor = audio_tensor * 32767
-    audio_tensor = torch.clamp(audio_tensor, -32768, 32767)
-    audio_np = audio_tensor.numpy().astype(np.int16)
-    
-    buffer = BytesIO()
-    with wave.open(buffer, 'wb') as wf:
-        wf.setnchannels(1)  # Mono
-        wf.setsampwidth(2)  # 16-bit
-        wf.setframerate(sample_rate)
-        wf.writeframes(audio_np.tobytes())
-    return buffer.getvalue()
-
-async def combine_audio_streams_with_vad(audio_streams):
-    """Combine multiple WAV audio streams with VAD filtering"""
-    if not audio_streams:
-        return None
-    
-    combined_speech_chunks = []
-    
-    for audio_stream in audio_streams:
-        try:
-            audio_segment = AudioSegment.from_wav(io.BytesIO(audio_stream))
-            
-            raw_audio = audio_segment.raw_data
-            sample_rate = audio_segment.frame_rate
-
-            speech_timestamps, filtered_audio = await detect_speech_segments(raw_audio, sample_rate)
-            
-            if filtered_audio is not None:
-                combined_speech_chunks.append(filtered_audio)
-                
-        except Exception as e:
-            print(f"Error processing audio stream: {e}")
-
-    if not combined_speech_chunks:
+        # retries are owned by the governor so they respect shared budgets and Retry-After
+        _client_openai = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+    return _client_openai
+
+def get_openai_client():
+    return _client_openai or init_openai_client()
+
+async def close_openai_client():
+    global _client_openai
+    if _client_openai is not None:
+        await _client_openai.close()
+        _client_openai = None
+
+# Bound concurrent Whisper uploads per worker so STT can't starve other requests
+STT_MAX_CONCURRENCY = int(os.getenv("STT_MAX_CONCURRENCY", "8"))
+_stt_semaphore = None
+
+def get_stt_semaphore():
+    # created lazily so it binds to the running event loop
+    global _stt_semaphore
+    if _stt_semaphore is None:
+        _stt_semaphore = asyncio.Semaphore(STT_MAX_CONCURRENCY)
+    return _stt_semaphore
+
+def _wav_seconds(wav_bytes):
+    try:
+        with wave.open(io.BytesIO(wav_bytes)) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
         return None
-    
-    combined_audio_tensor = torch.cat(combined_speech_chunks, dim=0)
-    
-    audio_bytes = await tensor_to_wav_bytes(combined_audio_tensor)
-    
-    return audio_bytes
 
-async def speech_to_text_with_vad(audioFile):
-    """Speech to text with VAD preprocessing"""
+async def speech_to_text_with_vad(audioFile, prompt=None):
+    """
+    Speech to text with VAD preprocessing.
+    `prompt` passes the preceding transcript to Whisper so segment boundaries stitch cleanly.
+    """
     if audioFile is None or len(audioFile) < 1600:  
         return ""
-    t = time.time()
     audioBuffer = io.BytesIO(audioFile)
     audioBuffer.name = f"audio_{random.randint(100000, 999999)}.wav"
     
-    transcription = client.audio.transcriptions.create(
-        model="whisper-1",
-        file=audioBuffer,
-        response_format="text",
-        language="en"
-    )
-    
-    print(f"STT time: {time.time() - t} seconds")
+    options = {"prompt": prompt} if prompt else {}
+    async def transcribe():
+        audioBuffer.seek(0)  # a retried attempt re-reads the upload from the start
+        t = time.time()  # per attempt, so the STT semaphore and governor queueing are not counted
+        transcription = await get_openai_client().audio.transcriptions.create(
+            model="whisper-1",
+            file=audioBuffer,
+            response_format="text",
+            language="en",
+            **options
+        )
+        stt_seconds = time.time() - t
+        observe_transcription("whisper-1", stt_seconds, _wav_seconds(audioFile))
+        print(f"STT time: {stt_seconds} seconds")
+        return transcription
+
+    async with get_stt_semaphore():
+        transcription = await governor.call("whisper-1", transcribe, estimated_tokens=0)
     
     return transcription
 
-async def generate_openai_response(system_prompt: str, user_prompt: str):
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+# model for full LinkedIn posts (streamed, speculative and batch)
+POST_MODEL = "gpt-4o-2024-05-13"
+
+async def generate_openai_response(system_prompt: str, user_prompt: str, user=None, priority=INTERACTIVE, model="gpt-4o-mini", template=None, **options):
+    """Non-streaming completion; `options` (response_format, max_tokens, ...) go to the API as-is"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    completion = await governor.call(
+        model,
+        lambda: observe_completion(
+            model, template, get_openai_client().chat.completions.create(model=model, messages=messages, **options)
+        ),
+        estimated_tokens=estimate_tokens(messages, options.get("max_tokens", 1000)),
+        priority=priority,
+        user=user
     )
     return completion.choices[0].message.content
 
-async def generate_openai_response_stream(system_prompt: str, user_prompt: str):
-    stream = await client_openai.chat.completions.create(
-        model="gpt-4o-2024-05-13",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        stream=True
+# Completion tokens a post stream is expected to use; what remains of it when a
+# stream is cancelled early counts as saved (each streamed chunk is ~one token)
+POST_EXPECTED_COMPLETION_TOKENS = int(os.getenv("POST_EXPECTED_COMPLETION_TOKENS", "1000"))
+
+LLM_STREAMS_CANCELLED = Counter(
+    "llm_streams_cancelled_total", "Upstream LLM streams closed before the model finished", ["model"]
+)
+LLM_TOKENS_SAVED = Counter(
+    "llm_stream_tokens_saved_total", "Estimated completion tokens not generated thanks to early cancellation", ["model"]
+)
+
+# identical concurrent post requests (double clicks, load balancer retries) share one upstream stream
+post_stream_flight = StreamFlight("post_stream")
+
+async def _model_pieces(model, messages, user, priority, template, sent, **options):
+    """Open one streaming completion under the governor and yield its text pieces; sent() marks each attempt"""
+    expected_tokens = options.get("max_tokens", POST_EXPECTED_COMPLETION_TOKENS)
+    timer = StreamTimer(model, template)
+
+    def create():
+        timer.start()  # restarted by each retry, so governor queueing is not counted
+        sent()
+        return get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},  # usage arrives in a final chunk without choices
+            **options
+        )
+
+    stream, grant = await governor.open_stream(
+        model,
+        create,
+        estimated_tokens=estimate_tokens(messages, max_tokens=expected_tokens),
+        priority=priority,
+        user=user
     )
-    
-    async def content_generator():
-        collected_content = ""
+    # the concurrency slot is held until the stream is fully consumed
+    emitted = 0
+    usage = None
+    finished = False
+    try:
         async for chunk in stream:
-            if chunk.choices[0].delta.content:
-                content_piece = chunk.choices[0].delta.content
-                collected_content += content_piece
-                yield content_piece
-    
-    return content_generator
\ No newline at end of file
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                timer.piece()
+                emitted += 1
+                yield chunk.choices[0].delta.content
+        finished = True
+        timer.finish(usage)
+    finally:
+        if not finished:
+            LLM_STREAMS_CANCELLED.labels(model).inc()
+            LLM_TOKENS_SAVED.labels(model).inc(max(0, expected_tokens - emitted))
+        await stream.close()  # also frees the HTTP connection when the stream is cancelled
+        grant.release()
+
+async def open_completion_stream(model, messages, user=None, priority=INTERACTIVE, template=None, **options):
+    """
+    Start a streaming completion and return (model, text pieces) once the first piece has arrived.
+    A slow first token starts the backup model (except for BACKGROUND work); whichever
+    streams first is kept, and its model is returned.
+    `options` are passed to chat.completions.create (e.g. response_format, max_tokens).
+    """
+    model, source, first = await hedged_first_piece(
+        model,
+        lambda candidate, sent: _model_pieces(candidate, messages, user, priority, template, sent, **options),
+        hedge=priority != BACKGROUND
+    )
+
+    async def pieces():
+        try:
+            if first is not None:
+                yield first
+            async for piece in source:
+                yield piece
+        finally:
+            await source.aclose()
+
+    return model, pieces()
+
+def post_stream_request(system_prompt: str, user_prompt: str, user=None, priority=INTERACTIVE, template=None):
+    """
+    Request key and stream opener for a post; shared by live and speculative generation.
+    `template` (a prompt template key) labels the token usage metrics.
+    """
+    model = POST_MODEL
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    async def open_stream():
+        _, pieces = await open_completion_stream(model, messages, user, priority, template)
+        return pieces
+
+    return request_key(model, messages), open_stream
+
+async def _wait_for_disconnect(request, stop):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            stop.set()
+            return
+
+async def subscribe_until_disconnect(fanout, request=None, offset=0):
+    """
+    Pieces of a StreamFanout from `offset`. With `request`, a client disconnect
+    ends the subscription at once; the upstream OpenAI stream is closed when
+    no other subscriber remains.
+    """
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(_wait_for_disconnect(request, stop)) if request is not None else None
+    try:
+        async for piece in fanout.subscribe(offset, stop=stop):
+            yield piece
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+# separates the post text from the trailing {"post_id": ...} record in plain-text streams
+STREAM_TRAILER_SEPARATOR = "\x1e"
+
+def stream_content(fanout, request=None, saved=None):
+    """
+    Plain-text generator over a StreamFanout, for StreamingResponse.
+    With `saved` (a future resolving to the persisted post id), the text is
+    followed by STREAM_TRAILER_SEPARATOR and {"post_id": ...} once it is stored.
+    """
+    async def content_generator():
+        async for content_piece in subscribe_until_disconnect(fanout, request):
+            yield content_piece
+        if saved is not None and fanout.done:
+            post_id = await asyncio.shield(saved)  # shared with resumed/coalesced readers
+            if post_id:
+                yield STREAM_TRAILER_SEPARATOR + json.dumps({"post_id": post_id})
+
+    return content_generator
+
+async def open_post_stream(system_prompt: str, user_prompt: str, user=None, priority=INTERACTIVE, template=None):
+    """Start (or join an identical in-flight) post stream and return its StreamFanout"""
+    key, open_stream = post_stream_request(system_prompt, user_prompt, user, priority, template)
+    return await post_stream_flight.open(key, open_stream)
+
+async def generate_openai_response_stream(system_prompt: str, user_prompt: str, user=None, priority=INTERACTIVE, request=None):
+    fanout = await open_post_stream(system_prompt, user_prompt, user, priority)
+    return stream_content(fanout, request)
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import torch
+from prometheus_client import Gauge, Histogram
+
+VAD_MAX_BATCH_SIZE = int(os.getenv("VAD_MAX_BATCH_SIZE", "64"))
+VAD_MAX_WAIT_MS = float(os.getenv("VAD_MAX_WAIT_MS", "5"))
+
+VAD_QUEUE_DEPTH = Gauge("vad_queue_depth", "VAD jobs waiting for the inference worker")
+VAD_ACTIVE_JOBS = Gauge("vad_active_jobs", "VAD jobs currently being evaluated by the inference worker")
+VAD_BATCH_SIZE = Histogram(
+    "vad_batch_size", "Sessions evaluated per batched VAD model call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+VAD_QUEUE_WAIT = Histogram("vad_queue_wait_seconds", "Time a VAD job waits before its first batch")
+
+
+class _Job:
+    """One session's run of consecutive windows plus its recurrent state"""
+    def __init__(self, windows, state, context, loop, future):
+        self.windows = windows
+        self.state = state
+        self.context = context
+        self.loop = loop
+        self.future = future
+        self.position = 0
+        self.probs = []
+        self.submitted_at = time.monotonic()
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():  # the connection went away while we were computing
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class VADBatchWorker:
+    """
+    Dedicated thread that owns Silero inference for every connection.
+    Sessions submit a run of windows with their own state; the worker
+    evaluates the next window of up to `max_batch_size` sessions in a single
+    model call, so concurrent dictations share batches instead of
+    serializing torch calls on the event loop.
+    """
+    def __init__(self, load_model, max_batch_size=VAD_MAX_BATCH_SIZE, max_wait_ms=VAD_MAX_WAIT_MS):
+        self.load_model = load_model  # called on the worker thread, so loading never blocks the event loop
+        self.model = None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._dead = None  # the model load error once the worker has given up
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vad-worker", daemon=True)
+                self._thread.start()
+
+    async def infer(self, windows, state, context):
+        """
+        Evaluate `windows` ([n, window] float tensor) in order for one session.
+        Returns (speech probabilities, new state, new context).
+        """
+        if not len(windows):
+            return [], state, context
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:  # no job slips in after a failed worker drained the queue
+            if self._dead is not None:
+                raise self._dead
+            self._queue.put(_Job(windows, state, context, loop, future))
+        VAD_QUEUE_DEPTH.set(self._queue.qsize())
+        return await future
+
+    def _collect(self, active):
+        """Pull queued jobs; when idle, wait up to max_wait for a batch to form"""
+        if not active:
+            active.append(self._queue.get())
+            deadline = time.monotonic() + self.max_wait
+            while len(active) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    active.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            while True:
+                try:
+                    active.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        VAD_QUEUE_DEPTH.set(self._queue.qsize())
+        VAD_ACTIVE_JOBS.set(len(active))
+
+    @torch.no_grad()
+    def _step(self, batch):
+        x = torch.cat([
+            torch.cat([job.context, job.windows[job.position:job.position + 1]], dim=1)
+            for job in batch
+        ])
+        state = torch.cat([job.state for job in batch], dim=1)
+        out, new_state = self.model._model(x, state)
+        context_size = batch[0].context.shape[1]
+        for i, job in enumerate(batch):
+            job.probs.append(out[i].item())
+            job.state = new_state[:, i:i + 1]
+            job.context = x[i:i + 1, -context_size:]
+            job.position += 1
+
+    def _fail_queued(self, error):
+        """The model could not be loaded: fail every waiting and future job instead of hanging them"""
+        with self._lock:
+            self._dead = error
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                job.loop.call_soon_threadsafe(_resolve, job.future, None, error)
+        VAD_QUEUE_DEPTH.set(0)
+
+    def _run(self):
+        try:
+            self.model = self.load_model()
+        except Exception as e:
+            print(f"VAD model failed to load: {e}")
+            self._fail_queued(RuntimeError(f"VAD model unavailable: {e}"))
+            return
+        active = []
+        while True:
+            self._collect(active)
+            batch = active[:self.max_batch_size]
+            now = time.monotonic()
+            for job in batch:
+                if job.position == 0:
+                    VAD_QUEUE_WAIT.observe(now - job.submitted_at)
+            VAD_BATCH_SIZE.observe(len(batch))
+
+            try:
+                self._step(batch)
+            except Exception as e:
+                print(f"VAD worker error: {e}")
+                for job in batch:
+                    job.loop.call_soon_threadsafe(_resolve, job.future, None, e)
+                active = active[len(batch):]
+                continue
+
+            # round-robin: jobs that just ran go behind the ones that waited
+            unfinished = []
+            for job in batch:
+                if job.position == len(job.windows):
+                    job.loop.call_soon_threadsafe(_resolve, job.future, (job.probs, job.state, job.context))
+                else:
+                    unfinished.append(job)
+            active = active[len(batch):] + unfinished